@@ -0,0 +1,163 @@
+"""
+Benchmarks of the hot paths of GPKernel, driven directly (without ZMQ).
+
+Runs against the real gp if it is on the PATH, and against stub_gp.py
+otherwise (or with --gp stub), and prints the results as JSON:
+
+    python benchmarks/bench_kernel.py [--gp auto|real|stub] [--transport memfd] [-o results.json]
+
+All times are in seconds.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import signal
+import statistics
+import sys
+import threading
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+
+from gp_kernel.kernel import GPKernel, gp_builtins  # noqa: E402
+
+
+class BenchKernel(GPKernel):
+    """A GPKernel counting the output it would send to the frontend."""
+
+    def send_response(self, stream, msg_or_type, content=None, *args, **kwargs):
+        if msg_or_type == "stream":
+            self.output_size += len(content["text"])
+
+    output_size = 0
+
+    def execute(self, code):
+        """Run a cell as for an execute_request."""
+        self.pre_handler_hook()
+        try:
+            return self.loop.run_until_complete(self.do_execute(code, False))
+        finally:
+            self.post_handler_hook()
+
+
+def summary(times):
+    times = sorted(times)
+    return {
+        "n": len(times),
+        "mean": statistics.mean(times),
+        "median": statistics.median(times),
+        "p90": times[int(0.9 * (len(times) - 1))],
+        "min": times[0],
+        "max": times[-1],
+    }
+
+
+def timed(f, *args):
+    start = time.perf_counter()
+    f(*args)
+    return time.perf_counter() - start
+
+
+def bench_small_cell(kernel, repeat):
+    kernel.execute("1+1")
+    return summary([timed(kernel.execute, "1+1") for _ in range(repeat)])
+
+
+def bench_streaming(kernel, lines):
+    kernel.output_size = 0
+    elapsed = timed(kernel.execute, f"for(i=1,{lines},print(i))")
+    return {
+        "lines": lines,
+        "bytes": kernel.output_size,
+        "time": elapsed,
+        "MB/s": kernel.output_size / elapsed / 1e6,
+    }
+
+
+def bench_interrupt(kernel, repeat, delay=0.2):
+    times = []
+    for _ in range(repeat):
+        sent = []
+
+        def interrupt():
+            sent.append(time.perf_counter())
+            os.kill(os.getpid(), signal.SIGINT)
+
+        timer = threading.Timer(delay, interrupt)
+        timer.start()
+        kernel.execute("while(1,)")
+        times.append(time.perf_counter() - sent[0])
+    return summary(times)
+
+
+def bench_restart(kernel, repeat):
+    times = []
+    for _ in range(repeat):
+        old = kernel.child
+        times.append(timed(kernel._start_gp))
+        old.terminate(force=True)
+    return summary(times)
+
+
+def bench_complete(kernel, repeat):
+    # every proper prefix of every builtin, cursor at the end
+    prefixes = sorted({name[:k] for name in gp_builtins for k in range(1, len(name))})
+    codes = [f"x = {prefix}" for prefix in prefixes]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for code in codes:
+            kernel.do_complete(code, len(code))
+    elapsed = time.perf_counter() - start
+    return {"requests": repeat * len(codes), "mean": elapsed / (repeat * len(codes))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--gp", choices=["auto", "real", "stub"], default="auto")
+    parser.add_argument("--transport", default="tempfile")
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--lines", type=int, default=200000)
+    parser.add_argument("-o", "--output", help="write the results to this file")
+    args = parser.parse_args()
+
+    gp = args.gp
+    if gp == "auto":
+        gp = "real" if shutil.which("gp") else "stub"
+    executable = "gp" if gp == "real" else os.path.join(here, "stub_gp.py")
+
+    start = time.perf_counter()
+    kernel = BenchKernel(
+        gp_executable=executable, transport=args.transport, output_limit=0
+    )
+    startup = time.perf_counter() - start
+    kernel.loop = asyncio.new_event_loop()
+
+    results = {
+        "gp": gp,
+        "gp_version": kernel.language_version,
+        "transport": kernel._transport.name,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "startup": startup,
+        "small_cell": bench_small_cell(kernel, args.repeat),
+        "streaming": bench_streaming(kernel, args.lines),
+        "interrupt": bench_interrupt(kernel, max(1, args.repeat // 20)),
+        "restart": bench_restart(kernel, max(1, args.repeat // 20)),
+        "complete": bench_complete(kernel, 1),
+    }
+    kernel.do_shutdown(False)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+A stand-in for gp speaking the same prompt protocol, to benchmark the kernel
+where gp is not installed.  It understands just enough gp for the benchmarks
+and for the lines the kernel itself sends:
+
+    \\r <file>            read a file
+    print(...)           strings, integers and a few introspection functions
+    error(...)           prints an error block
+    for(i=a,b,print(i))  the streaming benchmark
+    while(1,)            runs until interrupted
+    integer arithmetic   printed as %n = ...
+    ?...                 help, always empty
+"""
+import re
+import signal
+import sys
+import time
+
+VERSION = "2.17.0"
+BANNER = f"""\
+                  GP/PARI CALCULATOR Version {VERSION} (stub)
+          stub running python {sys.version.split()[0]}
+
+"""
+
+start = time.process_time()
+history = []
+
+
+def split_top_level(code, sep):
+    parts, depth, current, in_string = [], 0, "", False
+    for c in code:
+        if c == '"':
+            in_string = not in_string
+        elif not in_string:
+            if c in "([{":
+                depth += 1
+            elif c in ")]}":
+                depth -= 1
+            elif c == sep and depth == 0:
+                parts.append(current)
+                current = ""
+                continue
+        current += c
+    parts.append(current)
+    return parts
+
+
+def evaluate(expr):
+    expr = expr.strip()
+    if expr.startswith('"') and expr.endswith('"'):
+        return expr[1:-1]
+    if expr == "getabstime()":
+        return str(int(1000 * (time.process_time() - start)))
+    if expr == "getstack()":
+        return "0"
+    if expr == "getheap()":
+        return f"[{len(history)}, 0]"
+    if expr == "%":
+        return history[-1] if history else "0"
+    if re.fullmatch(r"[\d+\-*/^() ]+", expr):
+        return str(eval(expr.replace("^", "**").replace("/", "//")))
+    return "0"
+
+
+class GPError(Exception):
+    pass
+
+
+def statement(code, out):
+    code = code.strip()
+    match = re.fullmatch(r"print\((.*)\)", code, re.S)
+    if match:
+        args = split_top_level(match.group(1), ",") if match.group(1) else []
+        out.write("".join(evaluate(a) for a in args) + "\n")
+        return None
+    match = re.fullmatch(r"error\((.*)\)", code, re.S)
+    if match:
+        raise GPError("user error: " + evaluate(match.group(1)))
+    match = re.fullmatch(r"for\(i=(\d+),(\d+),print\(i\)\)", code)
+    if match:
+        out.write("".join(f"{i}\n" for i in range(int(match[1]), int(match[2]) + 1)))
+        return None
+    if code == "while(1,)":
+        while True:
+            time.sleep(0.001)
+    if not code:
+        return None
+    return evaluate(code)
+
+
+def run(line, out):
+    """Run a line, return False on error."""
+    t = time.monotonic()
+    try:
+        statements = split_top_level(line, ";")
+        value = None
+        for s in statements:
+            value = statement(s, out)
+        if value is not None and statements[-1].strip():
+            history.append(value)
+            out.write(f"%{len(history)} = {value}\n")
+    except GPError as err:
+        out.write(f"  ***   at top-level: {line}\n  ***   ^-\n  ***   {err}\n")
+        return False
+    except KeyboardInterrupt:
+        ms = int(1000 * (time.monotonic() - t))
+        out.write(
+            f"  ***   at top-level: {line}\n  ***   ^-\n"
+            f"  ***   user interrupt after {ms} ms\n"
+        )
+        return False
+    return True
+
+
+def main():
+    prompt = "? "
+    args = sys.argv[1:]
+    for key, value in zip(args, args[1:]):
+        if key == "-D" and value.startswith("prompt="):
+            prompt = value[len("prompt="):]
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    out = sys.stdout
+    out.write(BANNER + prompt)
+    out.flush()
+    for line in sys.stdin:
+        line = line.rstrip("\n")
+        if line.startswith("\\r "):
+            with open(line[3:].strip()) as f:
+                for code in f.read().splitlines():
+                    if not run(code, out):
+                        break
+        elif line.strip() == "\\q":
+            break
+        elif line.startswith("?"):
+            pass
+        else:
+            run(line, out)
+        out.write(prompt)
+        out.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,10 @@
+import sys
+
+if sys.argv[1:2] == ["run"]:
+    from .runner import main
+
+    sys.exit(main(sys.argv[2:]))
+
 from ipykernel.kernelapp import IPKernelApp
 from .kernel import GPKernel 
 IPKernelApp.launch_instance(kernel_class=GPKernel)
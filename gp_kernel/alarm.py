@@ -0,0 +1,122 @@
+"""
+The time limit of a cell (see GPKernel.cell_timeout and %timeout), enforced
+by gp's alarm: every statement of the cell is prefixed with an alarm going
+off at the deadline, and the prefix is hidden from the error messages.
+"""
+from .syntax import statement_starts
+
+# the start of the line of an error message showing the code
+context = "  ***   at top-level: "
+
+
+def alarm_prefix(deadline):
+    """
+    The code raising an e_ALARM error at `deadline` (in milliseconds since
+    the epoch, as getwalltime() tells) in the statement it precedes: gp
+    clears the alarm at the end of each top-level statement.  alarm() counts
+    whole seconds, so the time left is rounded up, to at least a second.  It
+    is written as gp shows it in error messages.
+    """
+    return f"alarm(max(1,({deadline}-getwalltime()+999)\\1000));"
+
+
+def time_limited(code, deadline):
+    """The cell `code` with `alarm_prefix(deadline)` before each statement
+    (but the meta-commands)."""
+    prefix = alarm_prefix(deadline)
+    starts = statement_starts(code)
+    parts = []
+    for start, end in zip(starts, starts[1:] + [len(code)]):
+        statement = code[start:end]
+        if statement.strip() and not statement.lstrip().startswith(("\\", "?")):
+            statement = prefix + statement
+        parts.append(statement)
+    return "".join(parts)
+
+
+def _shown_prefix(shown, prefix):
+    """The length of what `shown` (the code of an error message) shows of
+    `prefix`, or 0."""
+    if shown.startswith(prefix):
+        return len(prefix)
+    if shown and prefix.startswith(shown):
+        # gp shows at most 46 characters from the start of the error
+        return len(shown)
+    if shown.startswith("..."):
+        # gp elides the start of a long statement with "...", maybe in the
+        # middle of the prefix
+        for start in range(1, len(prefix)):
+            if shown.startswith(prefix[start:], 3):
+                return 3 + len(prefix) - start
+    return 0
+
+
+def hide_alarm(output, prefix):
+    """Hide `prefix` (see `alarm_prefix`) from the error messages in
+    `output`, moving the caret under the code shown along."""
+    at = len(context)
+    lines = output.split("\n")
+    for i, line in enumerate(lines):
+        if not line.startswith(context):
+            continue
+        shown = line[at:].rstrip("\r")
+        length = _shown_prefix(shown, prefix)
+        if not length:
+            continue
+        if length == len(shown) and length < len(prefix):
+            # the code of the cell is not shown at all
+            lines[i] = line[:at] + "..." + line[at + length :]
+            length -= 3
+        else:
+            lines[i] = line[:at] + line[at + length :]
+        caret = lines[i + 1] if i + 1 < len(lines) else ""
+        begin = caret.find("^")
+        if not caret.startswith("  *** ") or begin < 0:
+            continue
+        end = len(caret.rstrip())
+
+        def moved(column):
+            if column <= at:
+                return column
+            return max(at, column - length)
+
+        begin, end, tail = moved(begin), moved(end), caret[end:]
+        lines[i + 1] = caret[:begin] + "^" + "-" * max(0, end - begin - 1) + tail
+    return "\n".join(lines)
+
+
+class AlarmFilter:
+    """
+    `hide_alarm` on an output fed as it comes: the error context lines are
+    held until the line of the caret under them is complete.
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.held = ""
+        # whether the output passed on ended in the middle of a line
+        self.continued = False
+
+    def feed(self, output):
+        lines = (self.held + output).split("\n")
+        # the first line held: the last one (incomplete) if it may be a
+        # context line, and the context line before it
+        start = 1 if self.continued else 0
+        first = len(lines)
+        if len(lines) - 2 >= start and lines[-2].startswith(context):
+            first = len(lines) - 2
+        elif len(lines) - 1 >= start and (
+            lines[-1].startswith(context) or context.startswith(lines[-1])
+        ):
+            first = len(lines) - 1
+        self.held = "\n".join(lines[first:])
+        self.continued = first == len(lines)
+        if self.continued:
+            output = "\n".join(lines)
+        else:
+            output = "".join(line + "\n" for line in lines[:first])
+        return hide_alarm(output, self.prefix)
+
+    def close(self):
+        output, self.held = self.held, ""
+        return hide_alarm(output, self.prefix)
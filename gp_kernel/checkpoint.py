@@ -0,0 +1,179 @@
+"""
+Checkpoints of the variables of a session (see GPKernel.magic_checkpoint).
+
+Each user variable (functions included, they are closures) is saved by gp
+with `writebin` to a file of its own, and only when a cell may have changed
+it since it was last saved: the names are read from the code of the cells
+(assignments, `&name` arguments, lists and maps changed in place), so the
+globals a function sets are only saved along with a cell naming them.  The
+functions installed or aliased by the cells are kept as code.  restore.gp
+then sets everything again in a fresh gp with a single `read`.
+
+What gp alone knows about (the variables set by files the cells read, the
+defaults) is not saved.
+"""
+import hashlib
+import json
+import os
+import re
+import time
+
+from .completion import cache_dir, definitions, inert
+
+# x = ..., x += ..., x[i] = ..., x++, x--
+changed = re.compile(
+    r"(?<![\w.])([A-Za-z_]\w*)\s*(?:\[[^\[\]]*\]\s*)*"
+    r"(?:(?:[-+*/%\\^]|\\/|<<|>>)?=(?!=)|\+\+|--)"
+)
+
+# arguments passed by reference, and the functions changing their first one
+by_reference = re.compile(r"(?<!&)&(?!&)\s*([A-Za-z_]\w*)")
+mutator = re.compile(
+    r"\b(?:listput|listinsert|listpop|listsort|listkill|mapput|mapdelete|kill)"
+    r"\s*\(\s*([A-Za-z_]\w*)\s*[,)]"
+)
+
+# install("name", ...) and alias("new", "old")
+setup_call = re.compile(
+    r'\b(?:install|alias)\s*\((?:"(?:\\.|[^"\\])*"|[^()"])*\)'
+)
+
+
+def changed_names(code):
+    """The names of the variables the cell `code` may change."""
+    names, _ = definitions(code)
+    code = inert.sub(" ", code)
+    names.update(changed.findall(code))
+    names.update(by_reference.findall(code))
+    names.update(mutator.findall(code))
+    return names
+
+
+def setup_calls(code):
+    """The install and alias calls of the cell `code`."""
+    # keep the strings, drop the comments
+    code = inert.sub(lambda m: m[0] if m[0].startswith('"') else " ", code)
+    return setup_call.findall(code)
+
+
+def gp_string(string):
+    """A gp string literal for `string`."""
+    return '"' + string.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def save_line(name, filename):
+    """The gp code writing the value of `name` to `filename`, if it is set."""
+    return f"if(!({name} === '{name}), writebin({gp_string(filename)}, {name}))"
+
+
+def default_directory():
+    """The checkpoint directory of the notebook, or None if the kernel does
+    not know its notebook."""
+    session = os.environ.get("JPY_SESSION_NAME")
+    if not session:
+        return None
+    key = hashlib.sha1(session.encode("utf-8")).hexdigest()[:16]
+    return cache_dir("checkpoints", key)
+
+
+class Checkpoint:
+    """
+    The checkpoint kept in `directory`: v<n>.bin per variable, the state in
+    checkpoint.json, and restore.gp.  A variable is saved by running
+    `save_line(name)` in gp, then calling `commit(name)`; `write_script()`
+    makes the saved variables part of what restore.gp restores.
+
+    A session starts with an empty checkpoint, and replaces the one left in
+    `directory` by an earlier session when it saves, unless it loaded it
+    first (see `load`).
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.state_file = os.path.join(directory, "checkpoint.json")
+        self.script = os.path.join(directory, "restore.gp")
+        # the names a cell may have changed since they were last saved
+        self.dirty = set()
+        # name -> file, setup code, and when the script was last written
+        self.files = {}
+        self.setup = []
+        self.time = None
+
+    def load(self):
+        """Take the checkpoint saved in the directory, by this session or an
+        earlier one.  Return False if there is none."""
+        try:
+            with open(self.state_file, encoding="utf-8") as f:
+                state = json.load(f)
+            files, setup, saved = state["files"], state["setup"], state["time"]
+        except (OSError, ValueError, KeyError):
+            return False
+        self.files, self.time = files, saved
+        for call in setup:
+            if call not in self.setup:
+                self.setup.append(call)
+        return True
+
+    def touch(self, code):
+        """Note what the cell `code` changes."""
+        self.dirty.update(changed_names(code))
+        for call in setup_calls(code):
+            if call not in self.setup:
+                self.setup.append(call)
+
+    def _filename(self, name):
+        if name not in self.files:
+            used = set(self.files.values())
+            self.files[name] = next(
+                f"v{n}.bin" for n in range(len(used) + 1) if f"v{n}.bin" not in used
+            )
+        return os.path.join(self.directory, self.files[name])
+
+    def save_line(self, name):
+        """The gp code saving `name`, if it is set, next to its file."""
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = self._filename(name) + ".tmp"
+        if os.path.exists(tmp):
+            # writebin appends
+            os.unlink(tmp)
+        return save_line(name, tmp)
+
+    def commit(self, name):
+        """Take the file written by `save_line(name)`, or forget `name` if it
+        was not set."""
+        self.dirty.discard(name)
+        filename = self._filename(name)
+        if os.path.exists(filename + ".tmp"):
+            os.replace(filename + ".tmp", filename)
+        else:
+            del self.files[name]
+            if os.path.exists(filename):
+                os.unlink(filename)
+
+    def write_script(self):
+        os.makedirs(self.directory, exist_ok=True)
+        lines = [f"{call};" for call in self.setup]
+        for name, filename in sorted(self.files.items()):
+            filename = os.path.join(self.directory, filename)
+            lines.append(f"{name} = read({gp_string(filename)});")
+        self.time = time.time()
+        state = {"files": self.files, "setup": self.setup, "time": self.time}
+        for filename, text in [
+            (self.script, "\n".join(lines) + "\n"),
+            (self.state_file, json.dumps(state)),
+        ]:
+            with open(filename + ".tmp", "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(filename + ".tmp", filename)
+
+    def restore_line(self):
+        """The gp code restoring the checkpoint, or None if there is none.  It
+        must not be quiet: gp undoes the assignments of a line ending with an
+        error."""
+        if not (self.files or self.setup) or not os.path.exists(self.script):
+            return None
+        return f"read({gp_string(self.script)});"
+
+    def restored(self):
+        """Note that the checkpoint was restored."""
+        self.dirty.difference_update(self.files)
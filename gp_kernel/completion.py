@@ -0,0 +1,225 @@
+"""
+The names offered by GPKernel.do_complete.
+
+The builtins are read from the help listings (`?1`, `?2`...) of the gp that
+actually runs, once per gp version: they are harvested by an auxiliary gp in
+a background thread and cached in $XDG_CACHE_HOME/gp_kernel/<version>/, so
+that later sessions start with the full list.  Until then the static
+`gp_builtins` of kernel.py is used.
+
+The names defined by the user are found in the code of the cells (functions,
+variables and member functions assigned to), and in the listing of gp's user
+functions (`?0`), which also shows the functions installed, aliased or
+defined in files read by the cell.  It is refreshed after each cell that may
+define something.
+"""
+import bisect
+import json
+import os
+import re
+import threading
+
+## The member functions of gp, as listed by `?20` (gp 2.17)
+gp_members = [
+    "a1",
+    "a2",
+    "a3",
+    "a4",
+    "a6",
+    "area",
+    "b2",
+    "b4",
+    "b6",
+    "b8",
+    "bid",
+    "bnf",
+    "c4",
+    "c6",
+    "clgp",
+    "codiff",
+    "cyc",
+    "diff",
+    "disc",
+    "e",
+    "eta",
+    "f",
+    "fu",
+    "gen",
+    "group",
+    "index",
+    "j",
+    "mod",
+    "nf",
+    "no",
+    "normfu",
+    "omega",
+    "orders",
+    "p",
+    "pol",
+    "polabs",
+    "r1",
+    "r2",
+    "reg",
+    "roots",
+    "sign",
+    "t2",
+    "tate",
+    "tu",
+    "zk",
+    "zkst",
+]
+
+identifier = re.compile(r"[A-Za-z_]\w*$")
+
+# strings and comments, which define nothing
+inert = re.compile(r'"(?:\\.|[^"\\])*"|\\\\[^\n]*|/\*.*?\*/', re.S)
+
+# name = ..., name(args) = ..., obj.name = ...
+assignment = re.compile(
+    r"(?<![\w.])([A-Za-z_]\w*)(\.[A-Za-z_]\w*)?\s*(\([^()]*\))?\s*=(?!=)"
+)
+
+# what defines functions the cell code does not show
+indirect = re.compile(r"\b(?:install|alias|read|readvec|export)\s*\(|^\s*\\r", re.M)
+
+
+def cache_dir(*names):
+    """The directory $XDG_CACHE_HOME/gp_kernel/<names...>."""
+    cache = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache, "gp_kernel", *names)
+
+
+def listed_names(output):
+    """
+    The names of a help listing (`?n`), or [] if the section is text rather
+    than a list of functions.
+    """
+    names = output.split()
+    if not all(identifier.match(name) for name in names):
+        return []
+    return names
+
+
+def help_sections(output):
+    """The numbers of the sections listed by `?`, except the user functions."""
+    return [int(n) for n in re.findall(r"^\s*(\d+): ", output, re.M) if int(n) > 0]
+
+
+def definitions(code):
+    """
+    The names a cell assigns to, as (names, member names).  Local variables
+    (my, local, loop indices) are included, as gp itself completes them.
+    """
+    names, members = set(), set()
+    for name, member, _ in assignment.findall(inert.sub(" ", code)):
+        if member:
+            members.add(member[1:])
+        else:
+            names.add(name)
+    return names, members
+
+
+def defines_indirectly(code):
+    """Whether the cell may define functions in a way only gp knows about."""
+    return bool(indirect.search(inert.sub(" ", code)))
+
+
+def matches(names, prefix):
+    """The names of the sorted list `names` starting with `prefix`."""
+    low = bisect.bisect_left(names, prefix)
+    high = low
+    while high < len(names) and names[high].startswith(prefix):
+        high += 1
+    return names[low:high]
+
+
+class CompletionIndex:
+    """
+    The sorted lists of names to complete.  The lists are replaced rather
+    than modified, so they can be read from another thread.
+    """
+
+    def __init__(self, builtins):
+        self.builtins = sorted(builtins)
+        self.members = sorted(gp_members)
+        self.user = []
+        self.version = None
+
+    def load(self, version, spawn, log=None):
+        """
+        Use the builtins of gp `version`, from the cache if possible, else
+        from the listings of a gp started by `spawn()` (which returns a
+        pexpect child and its prompt) in a background thread.
+        """
+        if version == self.version:
+            return
+        self.version = version
+        filename = os.path.join(cache_dir(version), "builtins.json")
+        try:
+            with open(filename, encoding="utf-8") as f:
+                self.builtins = sorted(json.load(f))
+            return
+        except (OSError, ValueError):
+            pass
+        threading.Thread(
+            target=self._harvest, args=(filename, spawn, log), daemon=True
+        ).start()
+
+    def _harvest(self, filename, spawn, log):
+        try:
+            child, prompt = spawn()
+            try:
+
+                def run(line):
+                    child.sendline(line)
+                    child.expect_exact(prompt, timeout=60)
+                    return child.before
+
+                names = set()
+                for section in help_sections(run("?")):
+                    names.update(listed_names(run(f"?{section}")))
+            finally:
+                child.terminate(force=True)
+        except Exception as err:
+            if log:
+                log.warning(f"Cannot list the gp builtins for completion: {err}")
+            return
+        if not names:
+            return
+        self.builtins = sorted(names)
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            tmp = f"{filename}.{os.getpid()}"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.builtins, f)
+            os.replace(tmp, filename)
+        except OSError:
+            pass
+
+    def add_definitions(self, code):
+        """Add the names assigned to by `code`."""
+        names, members = definitions(code)
+        if not names.issubset(self.user):
+            self.user = sorted(names.union(self.user))
+        if not members.issubset(self.members):
+            self.members = sorted(members.union(self.members))
+
+    def set_user_functions(self, output):
+        """Add the user functions from the output of `?0`."""
+        names = listed_names(output)
+        if not set(names).issubset(self.user):
+            self.user = sorted(set(self.user).union(names))
+
+    def reset_user(self):
+        """Forget the user names, when gp restarts."""
+        self.user = []
+        self.members = sorted(gp_members)
+
+    def complete(self, prefix, member=False):
+        if member:
+            return matches(self.members, prefix)
+        user = matches(self.user, prefix)
+        builtins = matches(self.builtins, prefix)
+        if not user:
+            return builtins
+        return sorted(set(user).union(builtins))
@@ -0,0 +1,117 @@
+"""
+gp's errors, for the error replies of GPKernel.do_execute.
+
+gp does not stop reading a cell at an error: it prints the error and goes on
+with the next statement.  The errors are spotted in the output as it streams
+(see ErrorWatch), and the first one gives the ename (gp's name of the error
+class, as errname() would return it), evalue (the message) and traceback
+(the whole error block) of the reply.
+"""
+import re
+
+# the first line of an error block (warnings are not errors)
+error_start = re.compile(r"  \*\*\*   (?:at top-level:|syntax error)")
+
+# the lines of a block locating the error rather than describing it
+error_context = re.compile(
+    r"  \*\*\*   (?:at top-level|in function [^:]*):|  \*\*\* +\^-*\s*$"
+)
+
+# the messages of pari_err, by error class (the more specific first)
+error_names = [
+    ("syntax error", "e_SYNTAX"),
+    ("user error", "e_USER"),
+    ("bug in", "e_BUG"),
+    ("alarm interrupt", "e_ALARM"),
+    ("thread stack overflows", "e_STACKTHREAD"),
+    ("stack overflows", "e_STACK"),
+    ("not enough memory", "e_MEM"),
+    ("not enough precomputed primes", "e_MAXPRIME"),
+    ("error opening|error while writing|error reading", "e_FILE"),
+    ("overflow in", "e_OVERFLOW"),
+    ("not a prime number", "e_PRIME"),
+    ("zero polynomial", "e_ROOTS0"),
+    ("constant polynomial", "e_CONSTPOL"),
+    ("not an irreducible polynomial", "e_IRREDPOL"),
+    ("elements not coprime", "e_COPRIME"),
+    ("impossible inverse", "e_INV"),
+    ("domain error", "e_DOMAIN"),
+    ("not an n-th power residue", "e_SQRTN"),
+    ("inconsistent dimensions", "e_DIM"),
+    ("inconsistent moduli", "e_MODULUS"),
+    ("inconsistent variables", "e_VAR"),
+    ("incorrect priority", "e_PRIORITY"),
+    ("incorrect type", "e_TYPE"),
+    ("forbidden", "e_TYPE2"),
+    ("inconsistent", "e_OP"),
+    ("nonexistent component", "e_COMPONENT"),
+    ("not a function", "e_NOTFUNC"),
+    ("is not yet implemented", "e_IMPL"),
+    ("not available on this system", "e_ARCH"),
+    ("is required, please install", "e_PACKAGE"),
+]
+error_names = [(re.compile(pattern), name) for pattern, name in error_names]
+
+
+class GPError:
+    def __init__(self, lines):
+        self.traceback = lines
+        message = [
+            re.sub(r"^  \*\*\* +|^ +", "", line)
+            for line in lines
+            if not error_context.match(line)
+        ]
+        self.evalue = "\n".join(message)
+        self.ename = next(
+            (name for pattern, name in error_names if pattern.search(self.evalue)),
+            "e_MISC",
+        )
+
+
+class ErrorWatch:
+    """
+    Find the first error block in an output fed as it comes.  The block is
+    its first line and the indented lines that follow it.
+    """
+
+    # longer lines are only looked at for their start
+    max_line = 1000
+
+    def __init__(self):
+        self.rest = ""
+        self.lines = None
+        self.open = False
+
+    def feed(self, output):
+        if self.lines is not None and not self.open:
+            return
+        lines = (self.rest + output).split("\n")
+        self.rest = lines.pop()[: self.max_line]
+        for line in lines:
+            self._line(line.rstrip("\r"))
+
+    def _line(self, line):
+        if self.open:
+            # the error of the next statement follows without a break
+            if line.startswith("  ") and not error_start.match(line):
+                self.lines.append(line)
+            else:
+                self.open = False
+        elif self.lines is None and error_start.match(line):
+            self.lines = [line]
+            self.open = True
+
+    def close(self):
+        """The first error, as a GPError, or None."""
+        if self.rest:
+            self._line(self.rest.rstrip("\r"))
+            self.rest = ""
+        self.open = False
+        return GPError(self.lines) if self.lines else None
+
+
+def find_error(output):
+    """The first error of `output`, as a GPError, or None."""
+    watch = ErrorWatch()
+    watch.feed(output)
+    return watch.close()
@@ -0,0 +1,137 @@
+"""
+The help shown by GPKernel.do_inspect.
+
+The help of every builtin (`?name`) is harvested by an auxiliary gp the first
+time it is asked for, and kept in a sqlite database next to the completion
+cache (see completion.py), one per gp version, so that looking a name up
+never waits for gp.  The help the user attaches to their own functions with
+`addhelp` is read from the code of the cells.
+"""
+import os
+import re
+import sqlite3
+import threading
+
+from .completion import cache_dir, identifier, inert
+
+addhelp = re.compile(r'\baddhelp\s*\(\s*([A-Za-z_]\w*)\s*,\s*"((?:\\.|[^"\\])*)"\s*\)')
+
+
+def name_at(code, cursor_pos):
+    """
+    The name under the cursor, or else the function whose arguments the
+    cursor is in, or None.
+    """
+    name = re.search(r"\w*$", code[:cursor_pos]).group()
+    name += re.match(r"\w*", code[cursor_pos:]).group()
+    if identifier.match(name):
+        return name
+    depth = 0
+    for i in range(cursor_pos - 1, -1, -1):
+        if code[i] in ")]":
+            depth += 1
+        elif code[i] in "([":
+            if depth == 0:
+                match = re.search(r"([A-Za-z_]\w*)\s*$", code[:i])
+                return match.group(1) if code[i] == "(" and match else None
+            depth -= 1
+    return None
+
+
+def unescape(string):
+    """The value of the contents of a gp string literal."""
+    return re.sub(
+        r"\\(.)", lambda m: {"n": "\n", "t": "\t", "e": "\x1b"}.get(m[1], m[1]), string
+    )
+
+
+class HelpIndex:
+    def __init__(self):
+        # name -> help, from addhelp
+        self.user = {}
+        self.filename = None
+        self.db = None
+        self.building = False
+
+    def load(self, version, names, spawn, log=None):
+        """
+        Use the help of gp `version`.  If it is not in the cache, it will be
+        built on the first lookup, for the names returned by `names()`, from
+        the gp returned (with its prompt) by `spawn()`.
+        """
+        filename = os.path.join(cache_dir(version), "help.sqlite")
+        if filename != self.filename:
+            if self.db is not None:
+                self.db.close()
+            self.db = None
+            self.filename = filename
+            self.building = False
+        self.names = names
+        self.spawn = spawn
+        self.log = log
+
+    def _open(self):
+        if self.db is None and self.filename and os.path.exists(self.filename):
+            self.db = sqlite3.connect(f"file:{self.filename}?mode=ro", uri=True)
+        return self.db
+
+    def _build(self, filename, names):
+        try:
+            child, prompt = self.spawn()
+            try:
+                entries = []
+                for name in names:
+                    child.sendline(f"?{name}")
+                    child.expect_exact(prompt, timeout=60)
+                    text = child.before.replace("\r\n", "\n").strip()
+                    if text and not text.endswith("unknown identifier"):
+                        entries.append((name, text))
+            finally:
+                child.terminate(force=True)
+            if not entries:
+                return
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            tmp = f"{filename}.{os.getpid()}"
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            with sqlite3.connect(tmp) as db:
+                db.execute(
+                    "CREATE TABLE help (name TEXT PRIMARY KEY, text TEXT) WITHOUT ROWID"
+                )
+                db.executemany("INSERT INTO help VALUES (?, ?)", entries)
+            db.close()
+            os.replace(tmp, filename)
+        except Exception as err:
+            # not retried before the next version
+            if self.log:
+                self.log.warning(f"Cannot build the gp help index: {err}")
+
+    def lookup(self, name):
+        """The help of `name`, or None."""
+        if name in self.user:
+            return self.user[name]
+        db = self._open()
+        if db is None:
+            if self.filename and not self.building:
+                self.building = True
+                threading.Thread(
+                    target=self._build,
+                    args=(self.filename, list(self.names())),
+                    daemon=True,
+                ).start()
+            return None
+        row = db.execute("SELECT text FROM help WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def reset_user(self):
+        """Forget the help of the user functions, when gp restarts."""
+        self.user = {}
+
+    def add_definitions(self, code):
+        """Add the help given by the addhelp calls of `code`."""
+        if "addhelp" not in code:
+            return
+        # keep the strings, drop the comments
+        code = inert.sub(lambda m: m[0] if m[0].startswith('"') else " ", code)
+        for name, text in addhelp.findall(code):
+            self.user[name] = unescape(text)
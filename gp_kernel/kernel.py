@@ -1,14 +1,44 @@
 from ipykernel.kernelbase import Kernel
-from pexpect import EOF, TIMEOUT, spawn
-from tempfile import NamedTemporaryFile
+from pexpect import EOF
+from traitlets import Bool, Dict, Enum, Float, Integer, Unicode
 
-from os import path, fpathconf, fsync
+from os import cpu_count, environ, path, fpathconf
+import asyncio
+import atexit
+import inspect
+import itertools
+import json
 import re
+import shutil
 import signal
+import time
 import traceback
-import bisect
+import uuid
+import weakref
 
 from codecs import open
+from tempfile import mkdtemp
+
+from .alarm import AlarmFilter, alarm_prefix, time_limited
+from .checkpoint import (
+    Checkpoint,
+    changed_names,
+    default_directory,
+    gp_string,
+    save_line,
+)
+from .completion import CompletionIndex, cache_dir, defines_indirectly, definitions
+from .errors import ErrorWatch, GPError, find_error
+from .helpindex import HelpIndex, name_at
+from .memory import limit_growth, resident_size
+from .output import OutputBudget
+from .parmap import ParallelMap, WorkerError, progress_text, split_arguments
+from .pool import claim_gp, default_socket_path, spawn_gp, start_supervisor
+from .pump import OutputPump
+from .remote import AgentClient, RemoteTransport
+from .resultcache import ResultCache, cache_key
+from .syntax import Scanner, one_line
+from .transport import TempFileTransport, transports
 
 
 def readfile(filename):
@@ -16,6 +46,109 @@ def readfile(filename):
         return f.read()
 
 
+def launch_default(name, default=""):
+    """Default of a launch option, read from $GP_KERNEL_<NAME>."""
+    return environ.get(f"GP_KERNEL_{name.upper()}", default)
+
+
+def quiet(code):
+    """
+    A line running `code` without touching gp's history: gp records every
+    input (even `print(...)`), unless it ends with an error.
+    """
+    return f'{code}; error("")'
+
+
+quiet_error = re.compile(
+    r"  \*\*\*   at top-level: .*\n  \*\*\* .*\n  \*\*\*   user error: \r?\n$"
+)
+
+
+def unquiet(output):
+    """The output of a `quiet` line, without the final error."""
+    return quiet_error.sub("", output)
+
+
+def hide_read(output):
+    """Hide the fact that gp read the cell from a file from an error message."""
+    match = re.search(
+        r'  \*\*\*   at top-level: read\(".+\n  \*\*\*\s+\^-+\s+\n  \*\*\*\s+in function read:',
+        output,
+    )
+    if match:
+        begin, end = match.span()
+        output = output[0:begin] + "  ***   at top-level:    " + output[end:]
+    return output
+
+
+def out_of_band_supported(kernel):
+    """Whether the ipykernel of `kernel` has the internals GPKernel.shell_main
+    uses to answer requests while a cell runs (those of ipykernel 7)."""
+    try:
+        concurrent = "concurrent" in inspect.signature(Kernel.dispatch_shell).parameters
+    except (TypeError, ValueError):
+        return False
+    return (
+        concurrent
+        and hasattr(Kernel, "shell_main")
+        and hasattr(Kernel, "_get_shell_context_var")
+        and hasattr(kernel, "_shell_parent_ident")
+        and isinstance(getattr(kernel, "_main_asyncio_lock", None), asyncio.Lock)
+    )
+
+
+def expression_data(gp_type, text):
+    """
+    The mime bundle of a value of `gp_type` printed as `text`: text/plain,
+    and application/json for integers, reals, fractions and strings.
+    """
+    data = {"text/plain": text}
+    try:
+        if gp_type == "t_INT":
+            data["application/json"] = int(text)
+        elif gp_type == "t_REAL":
+            data["application/json"] = float(text.replace(" E", "e"))
+        elif gp_type == "t_FRAC":
+            numerator, denominator = text.split("/")
+            data["application/json"] = int(numerator) / int(denominator)
+        elif gp_type == "t_STR":
+            data["application/json"] = text
+    except (ValueError, OverflowError):
+        pass
+    return data
+
+
+magic_line = re.compile(r"[ \t]*(?:\\\\[ \t]*)?%([A-Za-z_]\w*)[ \t]*(.*)")
+
+
+def split_magics(code, names):
+    """
+    Split the magic lines at the top of a cell, `%name args` or
+    `\\\\%name args` (a comment for gp), for the magics `names`, from the code
+    that follows.  Return ([(name, args), ...], code).
+    """
+    magics = []
+    lines = code.split("\n")
+    while lines:
+        match = magic_line.fullmatch(lines[0])
+        if not match or match.group(1) not in names:
+            break
+        magics.append((match.group(1), match.group(2).strip()))
+        lines.pop(0)
+    return magics, "\n".join(lines)
+
+
+# the kernels of the process, whose gp is killed when it exits: gp ignores
+# SIGHUP, it would outlive the kernel in a long computation
+_kernels = weakref.WeakSet()
+
+
+@atexit.register
+def _kill_gp():
+    for kernel in list(_kernels):
+        kernel.child.kill(signal.SIGKILL)
+
+
 __version__ = readfile(path.join(path.dirname(__file__), "VERSION"))
 version_pat = re.compile(r"version (\d+(\.\d+)+)")
 
@@ -1119,6 +1252,36 @@ class GPKernel(Kernel):
     implementation_version = __version__
     _prompt = "$#PEXPECT_PROMPT#$"
 
+    output_flush_interval = Float(
+        0.05,
+        help="Maximal time (in seconds) that streamed output is held back to be "
+        "sent together with the output that follows it.",
+    ).tag(config=True)
+
+    output_chunk_size = Integer(
+        65536,
+        help="Maximal number of characters read from gp, or sent to the "
+        "frontend, at once.",
+    ).tag(config=True)
+
+    output_limit = Integer(
+        1000000,
+        help="Number of characters of the output of a cell sent to the frontend.  "
+        "Past it, the output is saved to a file, only its end is shown, and "
+        "%more shows the rest a page at a time.  0 for no limit.",
+    ).tag(config=True)
+
+    output_tail_size = Integer(
+        4096,
+        help="Number of bytes shown from the end of an output past output_limit.",
+    ).tag(config=True)
+
+    output_spill_limit = Integer(
+        2**30,
+        help="Maximal size in bytes of the file an output past output_limit is "
+        "saved to; the output that follows is dropped.",
+    ).tag(config=True)
+
     language_info = {
         "name": "gp",
         "codemirror_mode": "c",
@@ -1137,31 +1300,315 @@ class GPKernel(Kernel):
             },
         )
 
+    transport = Enum(
+        list(transports),
+        default_value="tempfile",
+        help="How cells are sent to gp: a new temporary file per cell "
+        "('tempfile'), a single in-memory file ('memfd', Linux only) or a "
+        "single named pipe ('fifo').",
+    ).tag(config=True)
+
+    # The launch profile: set these in the kernelspec, either in argv
+    # (--GPKernel.nbthreads=8) or in env (GP_KERNEL_NBTHREADS=8), or in
+    # ipython_kernel_config.py (c.GPKernel.nbthreads = 8).
+    gp_executable = Unicode(
+        launch_default("gp_executable", "gp"), help="The gp executable."
+    ).tag(config=True)
+
+    parisize = Unicode(
+        launch_default("parisize"),
+        help="Initial size of the PARI stack, e.g. '256M'.  Empty for gp's default.",
+    ).tag(config=True)
+
+    parisizemax = Unicode(
+        launch_default("parisizemax"),
+        help="Maximal size of the PARI stack, e.g. '4G'.  Empty for gp's default.",
+    ).tag(config=True)
+
+    nbthreads = Unicode(
+        launch_default("nbthreads"),
+        help="Number of threads of the MT engine, used by parapply, parfor...  "
+        "Empty for gp's default.",
+    ).tag(config=True)
+
+    primelimit = Unicode(
+        launch_default("primelimit"),
+        help="Bound of the precomputed primes.  Empty for gp's default.",
+    ).tag(config=True)
+
+    datadir = Unicode(
+        launch_default("datadir"),
+        help="Directory of the PARI data packages (galdata, elldata, seadata...).  "
+        "Empty for gp's default.",
+    ).tag(config=True)
+
+    gp_defaults = Dict(
+        help="Further gp defaults set on the command line, e.g. "
+        "{'realprecision': '100'}."
+    ).tag(config=True)
+
+    pool_size = Integer(
+        0,
+        help="Number of prompt-ready gp processes kept by the pool supervisor "
+        "(python -m gp_kernel.pool), started by the kernel if needed, so that "
+        "starting or restarting gp is instant.  0 disables the pool.",
+    ).tag(config=True)
+
+    pool_socket = Unicode(
+        "",
+        help="Unix socket of the pool supervisor, by default "
+        "$XDG_RUNTIME_DIR/gp_kernel_pool.sock.",
+    ).tag(config=True)
+
+    remote = Unicode(
+        launch_default("remote"),
+        help="host:port of a gp_kernel agent (python -m gp_kernel.remote) to "
+        "run gp on instead of locally.  Empty to run gp locally.",
+    ).tag(config=True)
+
+    remote_token = Unicode(
+        launch_default("remote_token"),
+        help="The token of the agent of `remote`.",
+    ).tag(config=True)
+
+    stats_footer = Bool(
+        False,
+        help="Print the wall time, cpu time and memory used by gp after each cell.",
+    ).tag(config=True)
+
+    stats_log = Unicode(
+        "",
+        help="A file where the timing and resources of each cell (also found in the "
+        "metadata of execute_reply) are appended as JSON lines.",
+    ).tag(config=True)
+
+    interrupt_timeout = Float(
+        5,
+        help="Seconds given to gp to stop after an interrupt, before it is "
+        "interrupted again, and then as much before it is terminated (and "
+        "restarted).",
+    ).tag(config=True)
+
+    kill_timeout = Float(
+        2,
+        help="Seconds given to gp to exit after SIGTERM, before SIGKILL.",
+    ).tag(config=True)
+
+    cell_timeout = Float(
+        0,
+        help="Seconds a cell may run (see %timeout to change it for a cell), 0 "
+        "for no limit.  gp raises an e_ALARM error, which iferr can catch, in "
+        "the statement running at the deadline; if gp is not back to its prompt "
+        "interrupt_timeout seconds later, the cell is interrupted.",
+    ).tag(config=True)
+
+    memory_soft_limit = Integer(
+        0,
+        help="Resident size of gp, in bytes, past which the running cell gets "
+        "a warning.  0 disables it.",
+    ).tag(config=True)
+
+    memory_hard_limit = Integer(
+        0,
+        help="Resident size of gp, in bytes, past which the running cell is "
+        "interrupted, and gp killed (and restarted) if it is still past it "
+        "kill_timeout seconds later; the reply is an e_MEM error.  gp is also "
+        "kept from allocating more than that past what it started with (with "
+        "setrlimit).  0 disables it.",
+    ).tag(config=True)
+
+    memory_check_interval = Float(
+        0.5,
+        help="Seconds between two looks at the resident size of gp while a "
+        "cell runs, for memory_soft_limit and memory_hard_limit.",
+    ).tag(config=True)
+
+    checkpoint_idle = Float(
+        0,
+        help="Seconds of idleness after which the variables changed by the cells "
+        "are checkpointed (see %checkpoint), to be restored if gp dies.  0 "
+        "disables the automatic checkpoints.",
+    ).tag(config=True)
+
+    idle_shrink = Float(
+        0,
+        help="Seconds of idleness after which gp's PARI stack is reallocated, "
+        "giving back to the system the memory a computation made gp touch.  0 "
+        "disables it.",
+    ).tag(config=True)
+
+    idle_hibernate = Float(
+        0,
+        help="Seconds of idleness after which the variables are checkpointed "
+        "(see %checkpoint) and gp is stopped, to be started again with them by "
+        "the next cell.  0 disables it.",
+    ).tag(config=True)
+
+    checkpoint_dir = Unicode(
+        "",
+        help="Directory of the checkpoint of the session, by default one per "
+        "notebook (named by $JPY_SESSION_NAME) in "
+        "$XDG_CACHE_HOME/gp_kernel/checkpoints, or one per kernel, removed at "
+        "shutdown, if the kernel does not know its notebook.",
+    ).tag(config=True)
+
+    result_cache_dir = Unicode(
+        "",
+        help="Directory of the results of the cells marked with %cache, which "
+        "can be shared by several kernels, by default "
+        "$XDG_CACHE_HOME/gp_kernel/results.",
+    ).tag(config=True)
+
+    result_cache_size = Integer(
+        4 * 2**30,
+        help="Size in bytes past which the least recently used results of "
+        "%cache are dropped.",
+    ).tag(config=True)
+
+    parmap_workers = Integer(
+        0,
+        help="Number of gp processes %parmap shards its vector across, 0 for "
+        "the number of cpus.",
+    ).tag(config=True)
+
+    parmap_retries = Integer(
+        2,
+        help="Number of times %parmap hands a part of its vector to a new "
+        "worker after the previous one died on it.",
+    ).tag(config=True)
+
     def __init__(self, **kwargs):
         Kernel.__init__(self, **kwargs)
+        self._stats = {}
+        self._reply_metadata = {}
+        self._completion = CompletionIndex(gp_builtins)
+        self._help = HelpIndex()
+        # the outputs past output_limit, by execution count, see magic_more
+        self._spills = {}
+        self._spill_dir = None
+        self._spill_ids = itertools.count()
+        # whether gp runs a cell, and how far it was interrupted, see
+        # _interrupt
+        self._interruptible = False
+        self._interrupt_stage = None
+        self._interrupt_event = None
+        # what _watch_memory did to the running cell, the size it acted on
+        # and the largest it saw
+        self._memory_stage = None
+        self._memory_size = 0
+        self._memory_peak = 0
+        # see magic_checkpoint and _idle_checkpoint; without a notebook to
+        # find it again by, the checkpoint is the kernel's own
+        directory = self.checkpoint_dir or default_directory()
+        self._private_checkpoint = directory is None
+        if directory is None:
+            directory = cache_dir("checkpoints", f"kernel-{uuid.uuid4().hex[:16]}")
+        self._checkpoint = Checkpoint(directory)
+        self._checkpointed = False
+        # the jobs run while the kernel is idle, see _schedule_idle
+        self._idle_timers = []
+        self._idle_task = None
+        self._idle_stop = False
+        # the precisions of the gp stopped by _hibernate, until _revive
+        self._hibernated = None
+        # see magic_cache
+        self._result_cache = ResultCache(
+            self.result_cache_dir or cache_dir("results"), self.result_cache_size
+        )
+        self._cache_cell = None
+        # the time limit set by %timeout for the cell, and whether the running
+        # cell overran it by interrupt_timeout
+        self._cell_timeout = None
+        self._timed_out = False
+        # the %parmap running, cancelled by an interrupt
+        self._parmap = None
+        # the error of a magic of the cell, for the reply
+        self._magic_error = None
+        # the input last asked about by is_complete_request
+        self._input_scan = Scanner()
+        # the user_expressions of the last execute request
+        self._expression_results = {}
+        self._out_of_band = out_of_band_supported(self)
+        if not self._out_of_band and self.log:
+            self.log.warning(
+                "This ipykernel does not let completion and inspection answer "
+                "while a cell runs"
+            )
+        # the agent running gp, if it does not run here
+        self._agent = None
+        if self.remote:
+            self._agent = AgentClient(self.remote, self.remote_token)
+            self._transport = RemoteTransport(self._agent)
+        else:
+            try:
+                self._transport = transports[self.transport]()
+            except (AttributeError, OSError) as err:
+                self.log.warning(
+                    f"Cannot use the {self.transport} transport ({err}), using temporary files"
+                )
+                self._transport = TempFileTransport()
         # sets child, banner, language_info, language_version
         self._start_gp()
+        _kernels.add(self)
+
+    def _gp_command(self):
+        defaults = {
+            "parisize": self.parisize,
+            "parisizemax": self.parisizemax,
+            "nbthreads": self.nbthreads,
+            "primelimit": self.primelimit,
+            "datadir": self.datadir,
+        }
+        defaults.update(self.gp_defaults)
+        defaults.update(
+            {
+                "prompt": self._prompt,
+                "breakloop": "0",
+                "colors": "no,no,no,no,no,no,no",
+                "readline": "0",
+            }
+        )
+        command = [self.gp_executable]
+        for key, value in defaults.items():
+            if value != "":
+                command += ["-D", f"{key}={value}"]
+        return command
+
+    def _spawn_gp(self):
+        if self._agent is not None:
+            return self._spawn_plain_gp()
+        command = self._gp_command()
+        if self.pool_size > 0:
+            socket_path = self.pool_socket or default_socket_path()
+            try:
+                claimed = claim_gp(socket_path, command, self._prompt)
+            except OSError:
+                start_supervisor(socket_path, self.pool_size)
+                claimed = None
+            if claimed:
+                return claimed
+        return spawn_gp(command, self._prompt)
+
+    def _spawn_plain_gp(self, dimensions=None):
+        """A gp started for the kernel, here or by the agent, without the
+        pool: return (child, banner)."""
+        if self._agent is not None:
+            return self._agent.spawn(self._gp_command(), self._prompt, dimensions)
+        return spawn_gp(self._gp_command(), self._prompt, dimensions=dimensions)
+
+    def _spawn_help_gp(self):
+        """A gp to read the help from, with a terminal high enough to not page
+        it."""
+        child, _ = self._spawn_plain_gp(dimensions=(10000, 80))
+        return child, self._prompt
 
     def _start_gp(self):
-        # Signal handlers are inherited by forked processes, and we can't easily
-        # reset it from the subprocess. Since kernelapp ignores SIGINT except in
-        # message handlers, we need to temporarily reset the SIGINT handler here
-        # so that gp and its children are interruptible.
-        sig = signal.signal(signal.SIGINT, signal.SIG_DFL)
-        try:
-            gp = spawn(
-                f"gp -D prompt='{self._prompt}' -D breakloop=0 -D colors='no,no,no,no,no,no,no' -D readline=0",
-                echo=False,
-                encoding="utf-8",
-                maxread=4194304,
-                ignore_sighup=True,
-                codec_errors="ignore",
-            )
-            gp.expect_exact(self._prompt)
-            banner = gp.before
-            self.child = gp
-        finally:
-            signal.signal(signal.SIGINT, sig)
+        self.child, banner = self._spawn_gp()
+        if self.memory_hard_limit > 0:
+            if not limit_growth(self.child.pid, self.memory_hard_limit) and self.log:
+                self.log.warning("Cannot limit the memory of gp with setrlimit")
+        # gp's cpu time, to measure the one of each cell
+        self._abstime = int(self._run_lines("print(getabstime())")[0])
 
         self.max_input_line_size = 255
         lang_version = re.search(
@@ -1170,128 +1617,1023 @@ class GPKernel(Kernel):
         self.banner = "GP kernel connected to GP " + lang_version
         self.language_info["version"] = lang_version
         self.language_version = lang_version
+        self._completion.reset_user()
+        self._completion.load(lang_version, self._spawn_help_gp, self.log)
+        self._help.reset_user()
+        self._help.load(
+            lang_version,
+            lambda: self._completion.builtins,
+            self._spawn_help_gp,
+            self.log,
+        )
 
-    def do_execute(
+    async def do_execute(
         self, code, silent, store_history=True, user_expressions=None, allow_stdin=False
     ):
         code = code.rstrip()
+        received = time.monotonic()
+        await self._stop_idle()
+        if self._hibernated is not None:
+            self._revive()
+
+        magics, code = split_magics(code, self._magics())
+        magic_error = None
+        for name, args in magics:
+            output = getattr(self, f"magic_{name}")(args)
+            if asyncio.iscoroutine(output):
+                output = await output
+            if output and not silent:
+                self.send_response(
+                    self.iopub_socket, "stream", {"name": "stdout", "text": output}
+                )
+            # as gp does, the rest of the cell still runs
+            magic_error = magic_error or self._magic_error
+            self._magic_error = None
+
+        cache, self._cache_cell = self._cache_cell, None
+        key = cache_status = None
+        if cache is not None and code.lstrip():
+            key = self._cache_key(code)
+            entry = None if cache == "refresh" else self._result_cache.lookup(key)
+            if entry is None:
+                cache_status = "miss"
+            else:
+                # set the variables of the cell instead of running it
+                cache_status = "hit"
+                key = None
+                if entry["output"] and not silent:
+                    self.send_response(
+                        self.iopub_socket,
+                        "stream",
+                        {"name": "stdout", "text": entry["output"]},
+                    )
+                code = " ".join(
+                    f"{name} = read({gp_string(filename)});"
+                    for name, filename in sorted(entry["files"].items())
+                )
+
+        timeout, self._cell_timeout = self._cell_timeout, None
+        if timeout is None:
+            timeout = self.cell_timeout
 
         if not code.lstrip():
+            expressions = self._user_expressions(user_expressions)
+            outputs = self._run_lines(*[line for line, _ in expressions])
+            for (_, handler), output in zip(expressions, outputs):
+                handler(output)
+            self._schedule_idle()
+            if cache_status:
+                # a hit without variables
+                self._stats["cache"] = cache_status
+            # the metadata of the previous cell must not stay
+            self._record_stats(time.monotonic() - received, silent)
+            if magic_error is not None:
+                return {
+                    "status": "error",
+                    "execution_count": self.execution_count,
+                    "ename": magic_error.ename,
+                    "evalue": magic_error.evalue,
+                    "traceback": magic_error.traceback,
+                }
             return {
                 "status": "ok",
                 "execution_count": self.execution_count,
                 "payload": [],
-                "user_expressions": {},
+                "user_expressions": self._expression_results,
             }
 
         interrupted = False
+        pump = OutputPump(
+            self.child,
+            self._prompt,
+            flush_interval=self.output_flush_interval,
+            chunk_size=self.output_chunk_size,
+        )
 
-        read_characters = [0]
-
-        def wait_for_output(read_characters, filename=None):
-            read_characters[0] = 0
-            # this function will *modify* the read_characters[0]
-            # handle error messages with filename
-            # output output initially on intervals of 0.5 seconds
-            # If no output is received, the interval slowly increases to 30 seconds over 5 min
-            initial_counter = counter = 10
-            initial_timeout = timeout = 0.1
-
-            while True:
-                v = self.child.expect_exact([self._prompt, TIMEOUT], timeout=timeout)
-
-                self.debug(f"v= {v}")
-                self.debug(f"self.child.before = {repr(self.child.before)}")
-                # something in output
-                if not silent and len(self.child.before) > read_characters[0]:
-                    output = self.child.before[read_characters[0] :]
-
-                    if filename:
-                        match = re.search(
-                            r'  \*\*\*   at top-level: read\(".+\n  \*\*\*\s+\^-+\s+\n  \*\*\*\s+in function read:',
-                            output,
-                        )
-                        self.debug(repr(output))
-                        if match:
-                            begin, end = match.span()
-                            # hide the fact that we read a temporary file
-                            output = (
-                                output[0:begin]
-                                + "  ***   at top-level:    "
-                                + output[end:]
-                            )
+        def send_stream(output):
+            if output:
+                self.send_response(
+                    self.iopub_socket,
+                    "stream",
+                    {
+                        "name": "stdout",
+                        "text": output,
+                    },
+                )
 
-                    if output:
-                        self.send_response(
-                            self.iopub_socket,
-                            "stream",
-                            {
-                                "name": "stdout",
-                                "text": output,
-                            },
-                        )
-                    read_characters[0] = len(self.child.before)
-                    counter = initial_counter
-                    timeout = initial_timeout
-                counter -= 1
-                # increase timeout after default_counter attempts of processing line
-                if counter <= 0:
-                    # timeout = min(30, 2 * timeout)
-                    counter = initial_counter
-                if v == 0:
-                    # finished waiting for output
-                    return
+        budget = OutputBudget(
+            send_stream,
+            self.output_limit,
+            path.join(self._spill_directory(), f"out{next(self._spill_ids)}.txt"),
+            self.output_tail_size,
+            self.output_spill_limit,
+        )
+
+        # the output of a cell to cache, dropped once past output_limit: the
+        # output of a cell that spills is not cached
+        collected = [] if key is not None else None
+        collected_size = 0
+        errors = ErrorWatch()
+
+        def send_output(output, filename=None):
+            nonlocal collected, collected_size
+            if filename:
+                self.debug(repr(output))
+                output = hide_read(output)
+                if alarm_filter is not None:
+                    output = alarm_filter.feed(output)
+            errors.feed(output)
+            if collected is not None:
+                collected.append(output)
+                collected_size += len(output)
+                if 0 < self.output_limit < collected_size:
+                    collected = None
+            if silent:
+                return
+            budget.write(output)
 
         append_to_output = ""
+        epilogue = self._epilogue(code) + self._user_expressions(user_expressions)
+        # None for the cell, then the output of each line of the epilogue
+        done = []
+
+        async def wait_for_prompts(on_output):
+            while len(done) < 1 + len(epilogue):
+                if not done:
+                    await pump.run_async(on_output)
+                    # interrupts must not reach the epilogue
+                    self._interruptible = False
+                    escalation.cancel()
+                    watchdog.cancel()
+                    if deadline is not None:
+                        deadline.cancel()
+                    done.append(None)
+                else:
+                    captured = []
+                    await pump.run_async(captured.append)
+                    done.append(unquiet("".join(captured)))
 
         self.debug("before try")
         self.debug(f"{len(code)} {self.max_input_line_size}")
+        start = time.monotonic()
+        self._interrupt_stage = None
+        self._interrupt_event = asyncio.Event()
+        escalation = asyncio.ensure_future(self._escalate_interrupt())
+        sent, alarm_filter, deadline = code, None, None
+        self._timed_out = False
+        if timeout > 0:
+            # gp raises e_ALARM at the deadline, and is interrupted if it
+            # does not
+            end = int((time.time() + timeout) * 1000)
+            sent, alarm_filter = time_limited(code, end), AlarmFilter(alarm_prefix(end))
+            deadline = asyncio.get_running_loop().call_later(
+                timeout + self.interrupt_timeout, self._overrun
+            )
+        self._memory_stage = None
+        self._memory_size = self._memory_peak = 0
+        watchdog = asyncio.ensure_future(self._watch_memory(send_stream))
         try:
-            # send the code via a temporary file
-            # trying to send small code directly is weird, as we get different number of
-            # prompts
-            with NamedTemporaryFile("w+t") as tmpfile:
-
-                self.debug(tmpfile.name)
-                tmpfile.write(code)
-                tmpfile.flush()
-                fsync(tmpfile.fileno())
-                self.child.sendline(fr'\r {tmpfile.name}')
-                wait_for_output(read_characters, tmpfile.name)
-        except KeyboardInterrupt:
-            self.debug("KeyboardInterrupt")
-            self.child.sendintr()
-            interrupted = True
-            wait_for_output(read_characters)
-            append_to_output = "Interrupted"
+            # send the code via a file, see transport.py, and the epilogue
+            # right after it
+            with self._transport.cell(sent) as filename:
+                self.debug(filename)
+                lines = [fr"\r {filename}"] + [line for line, _ in epilogue]
+                self._interruptible = True
+                self.child.send("".join(line + "\n" for line in lines))
+                await wait_for_prompts(lambda output: send_output(output, filename))
         except EOF:
             self.debug("EOF")
-            append_to_output = "Restarting GP"
-            self._start_gp()
+            append_to_output = self._restart_gp()
+        finally:
+            self._interruptible = False
+            escalation.cancel()
+            watchdog.cancel()
+            if deadline is not None:
+                deadline.cancel()
         self.debug("end of try block")
-
-        if not silent:
-            # Send standard output
-            self.send_response(
-                self.iopub_socket,
-                "stream",
-                {
-                    "name": "stdout",
-                    "text": self.child.before[read_characters[0] :] + append_to_output,
-                },
+        wall_time = time.monotonic() - start
+        if self._interrupt_stage:
+            interrupted = True
+            if not append_to_output and not self._timed_out:
+                append_to_output = "Interrupted\n"
+            elif self._interrupt_stage in ("sigterm", "sigkill"):
+                append_to_output = append_to_output.replace(
+                    "Restarting GP", "GP did not stop when interrupted, restarting GP"
+                )
+        if self._memory_stage == "kill":
+            append_to_output = append_to_output.replace(
+                "Restarting GP", "GP was killed past the memory limit, restarting GP"
             )
 
+        if alarm_filter is not None:
+            send_output(alarm_filter.close())
+        if append_to_output:
+            send_output(pump.pending)
+        budget.close()
+        if budget.truncated:
+            self._spills[self.execution_count] = budget
+        if append_to_output and not silent:
+            send_stream(append_to_output)
+
+        self._completion.add_definitions(code)
+        self._help.add_definitions(code)
+        self._checkpoint.touch(code)
+        for (_, handler), output in zip(epilogue, done[1:]):
+            handler(output)
+        error = errors.close()
+        timed_out = self._timed_out or (
+            timeout > 0 and error is not None and error.ename == "e_ALARM"
+        )
+        if magic_error is not None:
+            # the magics ran first
+            error = magic_error
+        if timed_out and not silent:
+            send_stream(f"Timed out after {wall_time:.1f}s (limit {timeout:g}s)\n")
+        if (
+            collected is not None
+            and not append_to_output
+            and not budget.truncated
+            and error is None
+        ):
+            self._cache_result(key, code, "".join(collected))
+        self._schedule_idle()
+        if cache_status:
+            self._stats["cache"] = cache_status
+        if self._interrupt_stage:
+            self._stats["interrupt"] = self._interrupt_stage
+        if self._memory_stage:
+            self._stats["memory"] = self._memory_stage
+        if self._memory_peak:
+            self._stats["memory_peak"] = self._memory_peak
+        if timed_out:
+            self._stats["timeout"] = timeout
+        self._record_stats(wall_time, silent)
+
+        if timed_out:
+            evalue = f"The cell timed out after {wall_time:.1f}s (limit {timeout:g}s)"
+            return {
+                "status": "error",
+                "execution_count": self.execution_count,
+                "ename": "e_ALARM",
+                "evalue": evalue,
+                "traceback": (error.traceback if error else []) + [evalue],
+            }
+
         if interrupted:
             return {"status": "abort", "execution_count": self.execution_count}
 
-        self.debug(self.child.before)
+        if self._memory_stage:
+            evalue = (
+                f"gp used {self._memory_size} bytes, past the memory limit of "
+                f"{self.memory_hard_limit} bytes"
+            )
+            return {
+                "status": "error",
+                "execution_count": self.execution_count,
+                "ename": "e_MEM",
+                "evalue": evalue,
+                "traceback": (error.traceback if error else []) + [evalue],
+            }
+
+        if error is not None and not append_to_output:
+            # makes the frontend abort the cells queued after this one, unless
+            # it asked not to (stop_on_error)
+            return {
+                "status": "error",
+                "execution_count": self.execution_count,
+                "ename": error.ename,
+                "evalue": error.evalue,
+                "traceback": error.traceback,
+            }
+
         return {
             "status": "ok",
             "execution_count": self.execution_count,
             "payload": [],
-            "user_expressions": {},
+            "user_expressions": self._expression_results,
         }
 
+    async def execute_batch(self, cells):
+        """
+        Run the code of each of `cells` in a single round trip to gp: all the
+        cells are queued at once, and the output is split at gp's prompts.
+        Nothing is sent to the frontend (see `python -m gp_kernel run
+        --batch`), and there are no magics, time or memory limits.
+
+        Return a list with, for each cell gp ran, a dict with its "status"
+        ("ok", "error" or "abort"), "output" and "wall_time", and for an
+        error the "ename", "evalue" and "traceback" of its reply.  An
+        interrupt (see `_interrupt`) stops the running cell as in do_execute,
+        and the cells gp has not read yet are cancelled: the list ends with
+        the interrupted cell.  An error does not stop the batch: gp reads the
+        next cells before their output comes back.
+        """
+        cells = [code.rstrip() for code in cells]
+        await self._stop_idle()
+        if self._hibernated is not None:
+            self._revive()
+        pump = OutputPump(
+            self.child,
+            self._prompt,
+            flush_interval=self.output_flush_interval,
+            chunk_size=self.output_chunk_size,
+        )
+        epilogue = self._epilogue("\n".join(cells))
+        outputs = []
+        times = []
+        # the cells after `ran` are not reported
+        ran = len(cells)
+        batch = None
+
+        async def cancel_on_interrupt():
+            """Once interrupted, cancel the cells gp has not started."""
+            nonlocal ran
+            await self._interrupt_event.wait()
+            ran = len(outputs) + 1
+            for i in range(ran, len(cells)):
+                batch.cancel(i)
+
+        async def wait_for_prompts():
+            last = time.monotonic()
+            while len(outputs) < len(cells) + len(epilogue):
+                captured = []
+                await pump.run_async(captured.append)
+                if len(outputs) >= len(cells):
+                    outputs.append(unquiet("".join(captured)))
+                    continue
+                outputs.append(hide_read("".join(captured)))
+                times.append(time.monotonic() - last)
+                last = time.monotonic()
+                if len(outputs) == len(cells):
+                    # interrupts must not reach the epilogue
+                    self._interruptible = False
+                    escalation.cancel()
+
+        self._interrupt_stage = None
+        self._interrupt_event = asyncio.Event()
+        escalation = asyncio.ensure_future(self._escalate_interrupt())
+        interrupt = asyncio.ensure_future(cancel_on_interrupt())
+        aborted = None
+        try:
+            with self._transport.cells(cells) as batch:
+                lines = [fr"\r {filename}" for filename in batch.filenames]
+                lines += [line for line, _ in epilogue]
+                self._interruptible = True
+                self.child.send("".join(line + "\n" for line in lines))
+                await wait_for_prompts()
+        except EOF:
+            if len(outputs) < len(cells):
+                aborted = len(outputs)
+                ran = min(ran, aborted + 1)
+                times.append(0.0)
+            outputs.append(pump.pending + self._restart_gp())
+        finally:
+            self._interruptible = False
+            escalation.cancel()
+            interrupt.cancel()
+        if self._interrupt_stage:
+            aborted = min(ran - 1, len(outputs) - 1)
+
+        for code in cells:
+            self._completion.add_definitions(code)
+            self._help.add_definitions(code)
+            self._checkpoint.touch(code)
+        for (_, handler), output in zip(epilogue, outputs[len(cells) :]):
+            handler(output)
+        self._stats = {}
+        self._schedule_idle()
+        results = []
+        for i, (output, wall_time) in enumerate(zip(outputs[:ran], times)):
+            result = {"status": "ok", "output": output, "wall_time": wall_time}
+            error = find_error(output)
+            if i == aborted:
+                result["status"] = "abort"
+            elif error is not None:
+                result.update(
+                    status="error",
+                    ename=error.ename,
+                    evalue=error.evalue,
+                    traceback=error.traceback,
+                )
+            results.append(result)
+        return results
+
+    def _run_lines(self, *lines, history=False):
+        """
+        Run each line of gp code, quietly (unless `history` is true), while
+        gp is idle, and return the output of each.
+        """
+        pump = OutputPump(self.child, self._prompt, flush_interval=0)
+        if not history:
+            lines = [quiet(line) for line in lines]
+        self.child.send("".join(line + "\n" for line in lines))
+        outputs = []
+        for _ in lines:
+            captured = []
+            pump.run(captured.append)
+            outputs.append(unquiet("".join(captured)))
+        return outputs
+
+    async def _run_lines_async(self, *lines):
+        """As `_run_lines`, without blocking the event loop."""
+        pump = OutputPump(self.child, self._prompt, flush_interval=0)
+        self.child.send("".join(quiet(line) + "\n" for line in lines))
+        outputs = []
+        for _ in lines:
+            captured = []
+            await pump.run_async(captured.append)
+            outputs.append(unquiet("".join(captured)))
+        return outputs
+
+    def _restart_gp(self):
+        """Start a new gp after the previous one died, restore the checkpoint
+        if the session keeps one, and return the message saying so."""
+        self._start_gp()
+        message = "Restarting GP\n"
+        if self._checkpointed:
+            message += self._restore_checkpoint()
+        return message
+
+    def _restore_checkpoint(self):
+        line = self._checkpoint.restore_line()
+        if line is None:
+            return "No checkpoint to restore\n"
+        output = self._run_lines(line, history=True)[0]
+        self._checkpoint.restored()
+        self._checkpointed = True
+        self._completion.set_user_functions(self._run_lines("?0", history=True)[0])
+        self._completion.set_user_functions(" ".join(self._checkpoint.files))
+        age = time.strftime("%H:%M:%S", time.localtime(self._checkpoint.time))
+        message = (
+            f"Restored {len(self._checkpoint.files)} variables from the "
+            f"checkpoint of {age}\n"
+        )
+        return output + message
+
+    def _save_checkpoint(self):
+        """Checkpoint the variables changed since the last checkpoint, and
+        return how many were saved."""
+        names = sorted(self._checkpoint.dirty)
+        self._run_lines(*[self._checkpoint.save_line(name) for name in names])
+        for name in names:
+            self._checkpoint.commit(name)
+        self._checkpoint.write_script()
+        self._checkpointed = True
+        return len(names)
+
+    def _precisions(self):
+        """The realprecision and seriesprecision of gp."""
+        values = self._run_lines(
+            'print(default(realprecision), " ", default(seriesprecision))'
+        )[0].split()
+        return dict(zip(["realprecision", "seriesprecision"], values))
+
+    def _cache_key(self, code):
+        return cache_key(code, self.language_version, self._precisions())
+
+    def _cache_result(self, key, code, output):
+        """Store the variables set by the cell `code` and its output."""
+        try:
+            directory = self._result_cache.new_entry()
+            self._run_lines(
+                *[
+                    save_line(name, path.join(directory, f"{name}.bin"))
+                    for name in sorted(changed_names(code))
+                ]
+            )
+            self._result_cache.commit(key, directory, output)
+        except OSError as err:
+            if self.log:
+                self.log.warning(f"Cannot cache the result of the cell: {err}")
+
+    def _schedule_idle(self):
+        """Start the timers of the jobs run once the kernel has been idle for
+        long enough: checkpoint, shrink and hibernation."""
+        jobs = []
+        if self.checkpoint_idle > 0 and self._checkpoint.dirty:
+            jobs.append((self.checkpoint_idle, self._idle_checkpoint))
+        if self.idle_shrink > 0:
+            jobs.append((self.idle_shrink, self._idle_shrink))
+        if self.idle_hibernate > 0:
+            jobs.append((self.idle_hibernate, self._hibernate))
+        loop = asyncio.get_running_loop()
+        self._idle_timers = [
+            loop.call_later(delay, self._start_idle, job) for delay, job in jobs
+        ]
+
+    def _start_idle(self, job):
+        # after the job still running, if any
+        self._idle_task = asyncio.ensure_future(self._run_idle(self._idle_task, job))
+
+    async def _run_idle(self, previous, job):
+        if previous is not None:
+            await previous
+        if not self._idle_stop and self._hibernated is None:
+            await job()
+
+    async def _stop_idle(self):
+        """Cancel the idle jobs to come, and end the one running early."""
+        for timer in self._idle_timers:
+            timer.cancel()
+        self._idle_timers = []
+        if self._idle_task is not None:
+            self._idle_stop = True
+            await self._idle_task
+            self._idle_task = None
+        self._idle_stop = False
+
+    async def _idle_checkpoint(self):
+        """
+        Checkpoint the changed variables while the kernel is idle, one at a
+        time, so that a cell coming in (see `_stop_idle`) only waits for the
+        variable being saved.
+        """
+        try:
+            for name in sorted(self._checkpoint.dirty):
+                if self._idle_stop:
+                    break
+                await self._run_lines_async(self._checkpoint.save_line(name))
+                self._checkpoint.commit(name)
+            self._checkpoint.write_script()
+            self._checkpointed = True
+        except Exception as err:
+            # gp died: the next cell restarts it
+            if self.log:
+                self.log.warning(f"Cannot checkpoint the session: {err}")
+
+    async def _idle_shrink(self):
+        """
+        Reallocate the PARI stack: gp keeps the pages of the stack a
+        computation touched (unless parisizemax lets it shrink the stack
+        itself), the new stack has none.  The variables, on the heap, stay.
+        """
+        before = resident_size(self.child.pid)
+        try:
+            # allocatemem ends its line, and does nothing for the current size
+            await self._run_lines_async(
+                "allocatemem(default(parisize) + 4096)",
+                "allocatemem(default(parisize) - 4096)",
+            )
+        except Exception as err:
+            if self.log:
+                self.log.warning(f"Cannot shrink the stack of gp: {err}")
+            return
+        after = resident_size(self.child.pid)
+        if before is not None and after is not None:
+            returned = max(0, before - after)
+            self._stats["shrunk"] = self._stats.get("shrunk", 0) + returned
+            if self.log:
+                self.log.info(f"Shrinking the stack of gp returned {returned} bytes")
+
+    async def _hibernate(self):
+        """
+        Checkpoint the changed variables and stop gp, to be started again by
+        `_revive`.  The history and the defaults other than the precisions
+        are lost, as are the variables the checkpoint does not know of.
+        """
+        await self._idle_checkpoint()
+        if self._idle_stop or self._checkpoint.dirty:
+            # a cell came in, or gp died
+            return
+        try:
+            precisions = self._precisions()
+        except EOF:
+            return
+        size = resident_size(self.child.pid)
+        self.child.kill(signal.SIGKILL)
+        self.child.close()
+        self._hibernated = precisions
+        if size is not None:
+            self._stats["hibernated"] = size
+        if self.log:
+            self.log.info(f"Stopped gp after {self.idle_hibernate}s of idleness")
+
+    def _revive(self):
+        """Start gp again after `_hibernate`, with the variables of the
+        checkpoint and the precisions it had."""
+        start = time.monotonic()
+        precisions, self._hibernated = self._hibernated, None
+        self._start_gp()
+        message = self._restore_checkpoint()
+        self._run_lines(
+            *[f"default({name}, {value})" for name, value in precisions.items()]
+        )
+        self._stats["revived"] = time.monotonic() - start
+        if self.log:
+            self.log.info(f"Started gp again: {message.strip()}")
+
+    def _epilogue(self, code):
+        """
+        The lines run right after the cell `code`, sent in the same write, as
+        pairs (line, handler): handler is called with the output of the line,
+        once the cell and the whole epilogue are done.  Lines of gp code must
+        be quiet (see `quiet`).  Lines are lost if gp dies.
+        """
+        epilogue = [
+            (
+                quiet(
+                    'print("gp_kernel:stats ", getabstime(), " ", getstack(), " ", getheap())'
+                ),
+                self._parse_stats,
+            ),
+        ]
+        if any(definitions(code)) or defines_indirectly(code):
+            # the user functions, for completion (meta-commands do not touch
+            # the history)
+            epilogue.append(("?0", self._completion.set_user_functions))
+        return epilogue
+
+    def _user_expressions(self, user_expressions):
+        """
+        Epilogue lines evaluating the `user_expressions` of an execute
+        request, whose handlers fill `_expression_results`.  The results of
+        the lines lost (gp died) are errors.
+        """
+        self._expression_results = {
+            name: {
+                "status": "error",
+                "ename": "e_MISC",
+                "evalue": "not evaluated",
+                "traceback": [],
+            }
+            for name in user_expressions or {}
+        }
+        lines = []
+        for name, expression in (user_expressions or {}).items():
+            # each line gets one prompt
+            expression = one_line(expression)
+            if expression is None:
+                self._expression_results[name].update(
+                    ename="e_SYNTAX", evalue="incomplete expression"
+                )
+                continue
+
+            def handler(output, name=name):
+                error = find_error(output)
+                if error is not None:
+                    self._expression_results[name] = {
+                        "status": "error",
+                        "ename": error.ename,
+                        "evalue": error.evalue,
+                        "traceback": error.traceback,
+                    }
+                    return
+                gp_type, _, text = output.replace("\r\n", "\n").partition("\n")
+                self._expression_results[name] = {
+                    "status": "ok",
+                    "data": expression_data(gp_type, text.rstrip("\n")),
+                    "metadata": {},
+                }
+
+            lines.append(
+                (
+                    quiet(
+                        f"my(gp_kernel_value = ({expression})); "
+                        "print(type(gp_kernel_value)); print(gp_kernel_value)"
+                    ),
+                    handler,
+                )
+            )
+        return lines
+
+    def _parse_stats(self, output):
+        match = re.search(r"gp_kernel:stats (\d+) (\d+) \[(\d+), (\d+)\]", output)
+        if match:
+            abstime, stack, objects, words = map(int, match.groups())
+            self._stats.update(
+                {
+                    "cpu_time": (abstime - self._abstime) / 1000,
+                    "stack_used": stack,
+                    "heap_objects": objects,
+                    "heap_words": words,
+                }
+            )
+            self._abstime = abstime
+
+    def _record_stats(self, wall_time, silent):
+        """Report the timing and resources of the cell that just ran."""
+        stats = dict(self._stats, wall_time=wall_time)
+        self._stats = {}
+        self._reply_metadata = {"gp_kernel": stats}
+        if self.stats_footer and not silent:
+            footer = f"-- wall time {wall_time:.3f}s"
+            if "cpu_time" in stats:
+                footer += (
+                    f", gp cpu time {stats['cpu_time']:.3f}s"
+                    f", stack {stats['stack_used']} bytes"
+                    f", heap {stats['heap_objects']} objects"
+                )
+            self.send_response(
+                self.iopub_socket, "stream", {"name": "stdout", "text": footer + "\n"}
+            )
+        if self.stats_log:
+            with open(self.stats_log, "a", encoding="utf-8") as log:
+                entry = dict(stats, execution_count=self.execution_count, time=time.time())
+                log.write(json.dumps(entry) + "\n")
+
+    # Requests answered without gp (from the completion index for the first
+    # three): they need not wait for the running cell.
+    out_of_band_requests = {
+        "complete_request",
+        "inspect_request",
+        "is_complete_request",
+        "kernel_info_request",
+    }
+
+    async def shell_main(self, subshell_id, msg):
+        """
+        Handle the shell messages, as ipykernel does, except that the requests
+        of `out_of_band_requests` are handled right away while a cell runs
+        (ipykernel only does so for comm messages).  This is effective while
+        do_execute waits for gp without blocking the event loop.  It relies on
+        internals of ipykernel 7, see `out_of_band_supported`.
+        """
+        if (
+            self._out_of_band
+            and subshell_id is None
+            and self._main_asyncio_lock.locked()
+            and self.session
+        ):
+            try:
+                _, frames = self.session.feed_identities(msg, copy=False)
+                header = self.session.deserialize(frames, content=False, copy=False)[
+                    "header"
+                ]
+            except Exception:
+                header = {}
+            if header.get("msg_type") in self.out_of_band_requests:
+                # the running cell still needs its parent for its output
+                shell_parent = self.get_parent("shell")
+                shell_ident = self._get_shell_context_var(self._shell_parent_ident)
+                try:
+                    await self.dispatch_shell(msg, subshell_id=None, concurrent=True)
+                finally:
+                    self.set_parent(shell_ident, shell_parent, channel="shell")
+                return
+        await Kernel.shell_main(self, subshell_id, msg)
+
+    def finish_metadata(self, parent, metadata, reply_content):
+        metadata = Kernel.finish_metadata(self, parent, metadata, reply_content)
+        metadata.update(self._reply_metadata)
+        return metadata
+
+    def pre_handler_hook(self):
+        # Handle SIGINT (sent by the frontend to interrupt a cell) by
+        # interrupting gp, instead of raising KeyboardInterrupt wherever the
+        # event loop happens to be.
+        self.saved_sigint_handler = signal.signal(signal.SIGINT, self._interrupt)
+
+    def _interrupt(self, signum, frame):
+        if self._parmap is not None:
+            asyncio.get_running_loop().call_soon_threadsafe(self._parmap.cancel)
+        elif self._interruptible and not self._interrupt_stage:
+            self._interrupt_stage = "sigint"
+            self.child.sendintr()
+            # the signal may arrive in the middle of the event loop
+            asyncio.get_running_loop().call_soon_threadsafe(self._interrupt_event.set)
+
+    def _overrun(self):
+        """Interrupt the cell gp did not stop at its deadline."""
+        if self._interruptible and not self._interrupt_stage:
+            self._timed_out = True
+            self._interrupt(None, None)
+
+    async def _escalate_interrupt(self):
+        """
+        Once the running cell is interrupted, make sure that it ends: if gp
+        is not back to its prompt after interrupt_timeout, interrupt it
+        again, then terminate it, then kill it.  The stage reached is
+        reported in the metadata of the reply, under gp_kernel.interrupt.
+        """
+        await self._interrupt_event.wait()
+        stages = [
+            ("sigint_repeated", self.child.sendintr, self.interrupt_timeout),
+            ("sigterm", lambda: self.child.kill(signal.SIGTERM), self.interrupt_timeout),
+            ("sigkill", lambda: self.child.kill(signal.SIGKILL), self.kill_timeout),
+        ]
+        for stage, action, timeout in stages:
+            await asyncio.sleep(timeout)
+            self._interrupt_stage = stage
+            action()
+
+    async def _watch_memory(self, warn):
+        """
+        Look at the resident size of gp while a cell runs: past
+        memory_soft_limit, `warn(message)`; past memory_hard_limit,
+        interrupt the cell, then kill gp if it is still past it kill_timeout
+        seconds later.  The stage reached is reported in the metadata of the
+        reply, under gp_kernel.memory, with the peak size under
+        gp_kernel.memory_peak.
+        """
+        if self.memory_soft_limit <= 0 and self.memory_hard_limit <= 0:
+            return
+        warned = False
+        deadline = None
+        while True:
+            await asyncio.sleep(self.memory_check_interval)
+            size = resident_size(self.child.pid)
+            if size is None:
+                return
+            self._memory_peak = max(self._memory_peak, size)
+            if 0 < self.memory_soft_limit <= size and not warned:
+                warned = True
+                warn(
+                    f"Warning: gp uses {size} bytes, past the memory limit "
+                    f"of {self.memory_soft_limit} bytes\n"
+                )
+            if not 0 < self.memory_hard_limit <= size:
+                continue
+            self._memory_size = max(self._memory_size, size)
+            if deadline is None and self._interruptible:
+                self._memory_stage = "interrupt"
+                deadline = time.monotonic() + self.kill_timeout
+                self.child.sendintr()
+            elif deadline is not None and time.monotonic() >= deadline:
+                self._memory_stage = "kill"
+                self.child.kill(signal.SIGKILL)
+                return
+
+    def _magics(self):
+        return {name[6:] for name in dir(self) if name.startswith("magic_")}
+
+    def _spill_directory(self):
+        if self._spill_dir is None:
+            self._spill_dir = mkdtemp(prefix="gp_kernel_output_")
+        return self._spill_dir
+
+    def magic_more(self, args):
+        """
+        %more [n]: show the next page of the output of cell n (by default the
+        last one) that did not fit in output_limit.
+        """
+        if not self._spills:
+            return "%more: no output was cut\n"
+        try:
+            n = int(args) if args else max(self._spills)
+        except ValueError:
+            return f"%more: not a cell number: {args}\n"
+        if n not in self._spills:
+            return f"%more: the output of cell {n} was not cut\n"
+        budget = self._spills[n]
+        page = budget.more(self.output_limit if self.output_limit > 0 else 1000000)
+        if budget.shown < budget.spilled:
+            page += f"[... type %more {n} for more ...]\n"
+        return page
+
+    def magic_cache(self, args):
+        """
+        %cache [refresh]: if the rest of the cell ran before, with the same gp
+        version, realprecision and seriesprecision, set the variables it set
+        and show its output from the result cache instead of running it; else
+        run it, and store them.  With refresh, run it anyway.
+        """
+        if args not in ("", "refresh"):
+            return f"%cache: unknown option {args}\n"
+        self._cache_cell = args
+        return ""
+
+    def magic_timeout(self, args):
+        """
+        %timeout seconds: limit the time the rest of the cell may run, instead
+        of cell_timeout (0 for no limit).
+        """
+        try:
+            seconds = float(args)
+        except ValueError:
+            return f"%timeout: not a number of seconds: {args}\n"
+        self._cell_timeout = max(0.0, seconds)
+        return ""
+
+    async def magic_parmap(self, args):
+        """
+        %parmap [R =] f, V: map the function f over the vector V with
+        parmap_workers gp processes, showing the progress, and set R to the
+        vector of the results (or show it).  f only sees the variables it
+        captured, not the globals of the session.
+        """
+        match = re.fullmatch(r"(?:([A-Za-z_]\w*)\s*=(?!=))?(.*)", args, re.S)
+        target, rest = match.groups()
+        parts = split_arguments(rest)
+        if len(parts) < 2 or not all(parts):
+            return "%parmap: usage: %parmap [R =] f, V\n"
+        function, vector = ",".join(parts[:-1]), parts[-1]
+        directory = mkdtemp(prefix="gp_kernel_parmap_")
+        function_file = path.join(directory, "f.bin")
+        vector_file = path.join(directory, "v.bin")
+        try:
+            saved = self._run_lines(
+                f"writebin({gp_string(function_file)}, {function})",
+                f"my(v = Vec({vector})); writebin({gp_string(vector_file)}, v); "
+                "print(#v)",
+            )
+            self._magic_error = find_error("".join(saved))
+            if self._magic_error is not None:
+                return "".join(saved)
+            size = int(saved[1])
+            setup = "".join(
+                f"default({name}, {value}); "
+                for name, value in self._precisions().items()
+            )
+            workers = self.parmap_workers or cpu_count()
+            parmap = ParallelMap(
+                lambda: self._spawn_plain_gp()[0],
+                self._prompt,
+                workers,
+                self.parmap_retries,
+                setup,
+            )
+            start = time.monotonic()
+            display_id = f"gp_kernel_parmap_{next(self._spill_ids)}"
+            last = 0
+
+            def progress(done, update=True):
+                nonlocal last
+                if time.monotonic() - last < 0.2 and done < size:
+                    return
+                last = time.monotonic()
+                self.send_response(
+                    self.iopub_socket,
+                    "update_display_data" if update else "display_data",
+                    {
+                        "data": {
+                            "text/plain": progress_text(
+                                done, size, min(workers, size), start
+                            )
+                        },
+                        "metadata": {},
+                        "transient": {"display_id": display_id},
+                    },
+                )
+
+            progress(0, update=False)
+            self._parmap = asyncio.ensure_future(
+                parmap.run(directory, function_file, vector_file, size, progress)
+            )
+            try:
+                chunks = await self._parmap
+            except asyncio.CancelledError:
+                return "Interrupted\n"
+            except WorkerError as err:
+                # gp's error in the function, or the workers killed
+                self._magic_error = find_error(str(err)) or GPError(
+                    [f"%parmap: {err}"]
+                )
+                return f"%parmap: {err}\n"
+            finally:
+                self._parmap = None
+            gather = path.join(directory, "gather.gp")
+            with open(gather, "w", encoding="utf-8") as f:
+                f.write(
+                    "concat([[]"
+                    + "".join(f", read({gp_string(chunk)})" for chunk in chunks)
+                    + "])\n"
+                )
+            line = f"read({gp_string(gather)})"
+            if target:
+                line = f"{target} = {line};"
+                self._completion.add_definitions(f"{target} = 0")
+                self._checkpoint.touch(f"{target} = 0")
+            output = self._run_lines(line, history=True)[0]
+            self._magic_error = find_error(output)
+            return output
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def magic_checkpoint(self, args):
+        """
+        %checkpoint: save the variables changed since the last checkpoint, to
+        be restored by %restore (in a new kernel too) or when gp dies.
+        """
+        saved = self._save_checkpoint()
+        return (
+            f"Checkpointed {saved} changed variables "
+            f"({len(self._checkpoint.files)} in all) in {self._checkpoint.directory}\n"
+        )
+
+    def magic_restore(self, args):
+        """%restore: set the variables saved by the last checkpoint of the
+        notebook, in this kernel or an earlier one."""
+        if not self._checkpoint.load():
+            return "No checkpoint to restore\n"
+        return self._restore_checkpoint()
+
+    def do_shutdown(self, restart):
+        _kernels.discard(self)
+        for timer in self._idle_timers:
+            timer.cancel()
+        self._transport.close()
+        # gp ignores SIGHUP
+        self.child.kill(signal.SIGKILL)
+        self.child.close()
+        if self._agent is not None:
+            # the agent kills its gp
+            self._agent.close()
+        if self._spill_dir is not None:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+        if self._private_checkpoint:
+            shutil.rmtree(self._checkpoint.directory, ignore_errors=True)
+        return {"status": "ok", "restart": restart}
+
     def do_complete(self, code, cursor_pos):
         code = code[:cursor_pos]
         default = {
@@ -1301,21 +2643,16 @@ class GPKernel(Kernel):
             "metadata": dict(),
             "status": "ok",
         }
-        if not code or code[-1] == " ":
-            return default
 
-        # get last token
-        token = code[:cursor_pos]
-        for sep in ["\n", ";", " ", "("]:  # we just need the last chunk
-            token = token.rpartition(sep)[-1]
-        if not token:
-            return default
+        # the identifier before the cursor, possibly after a member dot:
+        # E.disc, bnfinit(P).cyc
+        token = re.search(r"\w*$", code).group()
         start = cursor_pos - len(token)
+        member = re.search(r"(?:[A-Za-z_]\w*|[)\]])\.$", code[:start]) is not None
+        if not token and not member:
+            return default
 
-        low = bisect.bisect_left(gp_builtins, token)
-        # very hacky
-        high = bisect.bisect_right(gp_builtins, token + chr(127), low)
-        matches = gp_builtins[low:high]
+        matches = self._completion.complete(token, member)
 
         if not matches:
             return default
@@ -1327,3 +2664,22 @@ class GPKernel(Kernel):
             "metadata": dict(),
             "status": "ok",
         }
+
+    def do_is_complete(self, code):
+        self._input_scan = self._input_scan.resume(code)
+        status, indent = self._input_scan.status()
+        if status == "incomplete":
+            return {"status": status, "indent": indent}
+        return {"status": status}
+
+    def do_inspect(self, code, cursor_pos, detail_level=0, omit_sections=()):
+        name = name_at(code, cursor_pos)
+        text = self._help.lookup(name) if name else None
+        if text is None:
+            return {"status": "ok", "found": False, "data": {}, "metadata": {}}
+        return {
+            "status": "ok",
+            "found": True,
+            "data": {"text/plain": text},
+            "metadata": {},
+        }
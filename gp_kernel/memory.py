@@ -0,0 +1,43 @@
+"""
+The memory of gp as the system sees it, for the idle shrink and hibernation
+and the memory limits of GPKernel.
+"""
+try:
+    from resource import RLIMIT_AS, prlimit
+except ImportError:
+    # not on Linux
+    prlimit = None
+
+
+def _status_field(pid, field):
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def resident_size(pid):
+    """The resident set size of the process `pid` in bytes, or None where
+    /proc does not tell."""
+    return _status_field(pid, "VmRSS")
+
+
+def limit_growth(pid, size):
+    """
+    Let the address space of the process `pid` grow by at most `size` bytes
+    from now on (past it, its allocations fail).  The PARI stack is mapped
+    up front, up to parisizemax, so this limits the heap of a fresh gp.
+    Return False where this cannot be done.
+    """
+    current = _status_field(pid, "VmSize")
+    if prlimit is None or current is None:
+        return False
+    try:
+        prlimit(pid, RLIMIT_AS, (current + size, current + size))
+    except (OSError, ValueError):
+        return False
+    return True
@@ -0,0 +1,122 @@
+"""
+The output budget of a cell.
+
+The first `limit` characters a cell prints are sent to the frontend as they
+come.  Past that, the output is spilled to a file instead, and once the cell
+is done only a notice and the last `tail_size` bytes are sent, so that a cell
+printing factorial(10^6) or a huge matrix does not freeze the browser or end
+up in the notebook.  The rest is shown a page at a time with %more (see
+GPKernel.magic_more).
+
+The spill file is capped to `spill_limit` bytes: what comes after is dropped
+(but for the tail), so that a cell printing forever fills neither the memory
+nor the disk.  The output is still read from gp, which would block otherwise.
+"""
+
+
+def missing_bytes(data):
+    """The number of bytes the last UTF-8 character of `data` lacks."""
+    for k in range(1, min(4, len(data)) + 1):
+        byte = data[-k]
+        if byte & 0xC0 != 0x80:
+            # the first byte of the character tells its length
+            length = 1 if byte < 0xC0 else 2 if byte < 0xE0 else 3 if byte < 0xF0 else 4
+            return max(0, length - k)
+    return 0
+
+
+class OutputBudget:
+    def __init__(self, send, limit, filename, tail_size=4096, spill_limit=2**30):
+        self.send = send
+        self.limit = limit
+        self.filename = filename
+        self.tail_size = tail_size
+        self.spill_limit = spill_limit
+        # the output sent, kept until it spills (at most `limit` characters)
+        self.head = []
+        self.sent = 0
+        # bytes of the spill file taken by the head, and dropped after the cap
+        self.head_bytes = 0
+        self.spilled = 0
+        self.dropped = 0
+        # the last tail_size bytes of the output
+        self.tail = b""
+        self.file = None
+        # where %more resumes
+        self.shown = 0
+
+    @property
+    def truncated(self):
+        return self.file is not None
+
+    def write(self, output):
+        if self.file is None:
+            room = self.limit - self.sent
+            if self.limit <= 0 or len(output) <= room:
+                if output:
+                    self.send(output)
+                    self.sent += len(output)
+                    if self.limit > 0:
+                        self.head.append(output)
+                return
+            if room > 0:
+                self.send(output[:room])
+                self.sent += room
+                self.head.append(output[:room])
+            output = output[room:]
+            self._spill("".join(self.head))
+            self.head_bytes = self.spilled
+            self.head = []
+        self._spill(output)
+
+    def _spill(self, output):
+        if self.file is None:
+            self.file = open(self.filename, "wb")
+        data = output.encode("utf-8")
+        self.tail = (self.tail + data)[-self.tail_size :]
+        room = self.spill_limit - self.spilled
+        if len(data) > room:
+            self.dropped += len(data) - max(room, 0)
+            data = data[: max(room, 0)]
+        self.file.write(data)
+        self.spilled += len(data)
+
+    def close(self):
+        """Send the end of the output, if it was spilled."""
+        if self.file is None:
+            return
+        self.file.close()
+        rest = self.spilled + self.dropped - self.head_bytes
+        if rest <= len(self.tail):
+            # the tail may start within the head, already sent
+            self.send(self.tail[len(self.tail) - rest :].decode("utf-8", "ignore"))
+            self.shown = self.spilled
+            return
+        self.shown = self.head_bytes
+        # start the tail at a line
+        tail = self.tail
+        if b"\n" in tail[:-1]:
+            tail = tail[tail.index(b"\n") + 1 :]
+        notice = (
+            f"\n[... {rest - len(tail)} bytes of output omitted, "
+            f"type %more to see them (saved in {self.filename}"
+        )
+        if self.dropped:
+            notice += f", up to its first {self.spill_limit} bytes"
+        self.send(notice + ") ...]\n")
+        self.send(tail.decode("utf-8", "ignore"))
+
+    def more(self, size):
+        """The next `size` bytes (or so, up to a line end) of the spilled output."""
+        with open(self.filename, "rb") as f:
+            f.seek(self.shown)
+            data = f.read(size)
+            if len(data) == size:
+                end = data.rfind(b"\n")
+                if end > 0:
+                    data = data[: end + 1]
+                else:
+                    # up to the end of the last character
+                    data += f.read(missing_bytes(data))
+        self.shown += len(data)
+        return data.decode("utf-8", "ignore")
@@ -0,0 +1,166 @@
+"""
+A map over a vector, sharded across auxiliary gp processes (see
+GPKernel.magic_parmap).
+
+gp's own parapply needs a threaded build of PARI and shares one stack
+between its threads.  Here each worker is a gp of its own, started like the
+one of the kernel: it reads the function and the vector from `writebin`
+files once, then maps the function over the chunks of the vector it is
+handed, each to a `writebin` file, which the kernel's gp concatenates.  A
+chunk whose worker dies is handed to a new worker, up to `retries` times.
+
+The function only sees the variables it captured (`my` variables around a
+closure): the globals of the session are not in the workers.
+"""
+import asyncio
+import math
+import os
+import re
+import signal
+import time
+
+from pexpect import EOF
+
+from .checkpoint import gp_string
+from .pump import OutputPump
+
+worker_error = re.compile(r"^  \*\*\*   ", re.M)
+
+
+def split_arguments(text):
+    """Split `text` at its commas outside of brackets and strings."""
+    parts, depth, start, string = [], 0, 0, False
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if string:
+            if c == "\\":
+                i += 1
+            elif c == '"':
+                string = False
+        elif c == '"':
+            string = True
+        elif c in "([{":
+            depth += 1
+        elif c in ")]}":
+            depth -= 1
+        elif c == "," and depth == 0:
+            parts.append(text[start:i].strip())
+            start = i + 1
+        i += 1
+    parts.append(text[start:].strip())
+    return parts
+
+
+class WorkerError(Exception):
+    """The function failed, or a chunk killed too many workers."""
+
+
+class ParallelMap:
+    """
+    Map the function saved in `function_file` over the vector of `size`
+    elements saved in `vector_file`, with `workers` gp processes started by
+    `spawn()` (blocking, it returns a pexpect child at its prompt).  Each runs
+    the gp code `setup` first.
+    """
+
+    def __init__(self, spawn, prompt, workers, retries=2, setup=""):
+        self.spawn = spawn
+        self.prompt = prompt
+        self.workers = workers
+        self.retries = retries
+        self.setup = setup
+        self.done = 0
+        self.children = set()
+
+    async def run(self, directory, function_file, vector_file, size, progress):
+        """
+        Write the result of each chunk to a file of `directory`, and return
+        the list of these files, in order.  `progress(items done)` is called
+        after each chunk.  Raises WorkerError.
+        """
+        workers = max(1, min(self.workers, size))
+        # a few chunks per worker, so that they finish together
+        chunk = max(1, math.ceil(size / (workers * 8)))
+        queue = asyncio.Queue()
+        chunks = [(start, min(chunk, size - start)) for start in range(0, size, chunk)]
+        for i, (start, length) in enumerate(chunks):
+            queue.put_nowait((i, start, length, 0))
+        results = [None] * len(chunks)
+        self.done = 0
+        setup = (
+            f"gp_kernel_f = read({gp_string(function_file)}); "
+            f"gp_kernel_V = read({gp_string(vector_file)}); {self.setup}"
+        )
+
+        async def work():
+            child = None
+            try:
+                while not queue.empty():
+                    i, start, length, attempts = queue.get_nowait()
+                    result = os.path.join(directory, f"chunk{i}_{attempts}.bin")
+                    try:
+                        if child is None:
+                            child = await self._start(setup)
+                        output = await self._run(
+                            child,
+                            f"writebin({gp_string(result)}, vector({length}, i, "
+                            f"gp_kernel_f(gp_kernel_V[{start} + i])));",
+                        )
+                    except EOF:
+                        self._stop(child)
+                        child = None
+                        if attempts >= self.retries:
+                            raise WorkerError(
+                                f"the elements {start + 1} to {start + length} "
+                                f"killed {attempts + 1} workers"
+                            )
+                        queue.put_nowait((i, start, length, attempts + 1))
+                        continue
+                    if worker_error.search(output):
+                        raise WorkerError(output)
+                    results[i] = result
+                    self.done += length
+                    progress(self.done)
+            finally:
+                self._stop(child)
+
+        tasks = [asyncio.ensure_future(work()) for _ in range(workers)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            for child in list(self.children):
+                self._stop(child)
+        return results
+
+    async def _start(self, setup):
+        child = await asyncio.get_running_loop().run_in_executor(None, self.spawn)
+        self.children.add(child)
+        output = await self._run(child, setup)
+        if worker_error.search(output):
+            raise WorkerError(output)
+        return child
+
+    async def _run(self, child, line):
+        pump = OutputPump(child, self.prompt, flush_interval=0)
+        child.send(line + "\n")
+        captured = []
+        await pump.run_async(captured.append)
+        return "".join(captured)
+
+    def _stop(self, child):
+        if child is not None and child in self.children:
+            self.children.discard(child)
+            if child.isalive():
+                child.kill(signal.SIGKILL)
+            child.close(force=True)
+
+
+def progress_text(done, size, workers, start):
+    """The progress line of a map."""
+    return (
+        f"%parmap: {done}/{size} done with {workers} workers "
+        f"in {time.monotonic() - start:.1f}s"
+    )
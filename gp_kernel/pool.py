@@ -0,0 +1,387 @@
+"""
+Starting gp, and a pool of prompt-ready gp processes.
+
+Starting gp can take seconds (large parisize, a gprc loading packages...).
+The pool supervisor, started on demand by the first kernel that asks for it
+(see GPKernel.pool_size), keeps a few gp processes for each gp command line
+and working directory waiting at their first prompt.  A kernel claims one
+over a unix socket and receives the master side of its pty, after which the
+supervisor starts a replacement in the background.
+
+Warm processes share the environment of the kernel that first asked for
+them.  The supervisor exits once nobody claimed a process for `idle_timeout`
+seconds.
+
+    python -m gp_kernel.pool --size 2
+"""
+import argparse
+import errno
+import fcntl
+import json
+import os
+import pty
+import select
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import termios
+import threading
+import time
+
+from pexpect import spawn
+from pexpect.fdpexpect import fdspawn
+
+
+def _child_setup():
+    # Signal handlers are inherited by forked processes, and kernelapp
+    # ignores SIGINT except in message handlers, so that gp and its children
+    # would not be interruptible.
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    # Do not let the terminal discard the lines queued after a cell (see
+    # GPKernel._epilogue) when it is interrupted.
+    attrs = termios.tcgetattr(0)
+    attrs[3] |= termios.NOFLSH
+    termios.tcsetattr(0, termios.TCSANOW, attrs)
+
+
+def spawn_gp(command, prompt, dimensions=None):
+    """
+    Start gp with the argument list `command`, wait for its first `prompt`,
+    and return the pexpect child together with the banner.  `dimensions` is
+    the size (rows, columns) of its terminal.
+    """
+    gp = spawn(
+        command[0],
+        command[1:],
+        echo=False,
+        encoding="utf-8",
+        ignore_sighup=True,
+        codec_errors="ignore",
+        preexec_fn=_child_setup,
+        dimensions=dimensions,
+    )
+    # pexpect sleeps 50ms before each send by default
+    gp.delaybeforesend = None
+    gp.expect_exact(prompt)
+    return gp, gp.before
+
+
+class PooledGP(fdspawn):
+    """
+    A gp process started by the pool supervisor, driven through the master
+    side of its pty like a pexpect.spawn child.
+    """
+
+    def __init__(self, fd, pid):
+        fdspawn.__init__(self, fd, encoding="utf-8", codec_errors="ignore")
+        self.own_fd = True
+        self.pid = pid
+        # gp is the supervisor's child, not ours: once it died, its pid may
+        # be another process's.  A pidfd, opened while gp is known to run,
+        # cannot reach that process.
+        try:
+            self.pidfd = os.pidfd_open(pid)
+        except (AttributeError, OSError):
+            self.pidfd = None
+
+    def sendintr(self):
+        # the terminal sends SIGINT to gp, as with pexpect.spawn
+        self.send(chr(termios.tcgetattr(self.child_fd)[6][termios.VINTR][0]))
+
+    def _signal(self, sig):
+        """Send `sig` to gp, unless it is closed; return whether gp was
+        there to get it."""
+        if self.closed:
+            return False
+        try:
+            if self.pidfd is not None:
+                signal.pidfd_send_signal(self.pidfd, sig)
+            else:
+                os.kill(self.pid, sig)
+        except ProcessLookupError:
+            return False
+        return True
+
+    def isalive(self):
+        return self._signal(0)
+
+    def kill(self, sig):
+        self._signal(sig)
+
+    def close(self, force=False):
+        # as pexpect.spawn.close, which ParallelMap calls with force=True
+        if force:
+            self._signal(signal.SIGKILL)
+        fdspawn.close(self)
+        if self.pidfd is not None:
+            os.close(self.pidfd)
+            self.pidfd = None
+
+    def terminate(self, force=False):
+        self.kill(signal.SIGKILL if force else signal.SIGTERM)
+        self.close()
+        return True
+
+
+def default_socket_path():
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if not runtime_dir:
+        runtime_dir = os.path.join("/tmp", f"gp_kernel-{os.getuid()}")
+        os.makedirs(runtime_dir, mode=0o700, exist_ok=True)
+    return os.path.join(runtime_dir, "gp_kernel_pool.sock")
+
+
+def _send_json(sock, obj, fds=()):
+    data = json.dumps(obj).encode("utf-8") + b"\n"
+    socket.send_fds(sock, [data], list(fds))
+
+
+def _recv_json(sock):
+    data, fds, _, _ = socket.recv_fds(sock, 1 << 20, 1)
+    return json.loads(data.decode("utf-8")), fds
+
+
+def claim_gp(socket_path, command, prompt, timeout=5):
+    """
+    Ask the supervisor listening on `socket_path` for a prompt-ready gp.
+
+    Returns (child, banner), or None if the supervisor has no process ready
+    (it will have one next time).  Raises OSError if there is no supervisor.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        _send_json(
+            sock,
+            {
+                "command": command,
+                "prompt": prompt,
+                "cwd": os.getcwd(),
+                "env": dict(os.environ),
+            },
+        )
+        reply, fds = _recv_json(sock)
+    if not fds:
+        return None
+    child = PooledGP(fds[0], reply["pid"])
+    child.delaybeforesend = None
+    return child, reply["banner"]
+
+
+def start_supervisor(socket_path, size):
+    """Start a detached supervisor for `socket_path`, without waiting for it."""
+    subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "gp_kernel.pool",
+            "--socket",
+            socket_path,
+            "--size",
+            str(size),
+        ],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+
+def _fork_gp(command, prompt, cwd, env, timeout=120, dimensions=(24, 80)):
+    """Start gp on a new pty of `dimensions` (rows, columns), return (pid,
+    master fd, banner)."""
+    pid, fd = pty.fork()
+    if pid == 0:
+        try:
+            _child_setup()
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            attrs = termios.tcgetattr(0)
+            attrs[3] &= ~termios.ECHO
+            termios.tcsetattr(0, termios.TCSANOW, attrs)
+            fcntl.ioctl(0, termios.TIOCSWINSZ, struct.pack("HHHH", *dimensions, 0, 0))
+            os.chdir(cwd)
+            os.execvpe(command[0], command, env)
+        finally:
+            os._exit(127)
+
+    output = b""
+    deadline = time.monotonic() + timeout
+    while prompt.encode("utf-8") not in output:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+            break
+        try:
+            data = os.read(fd, 65536)
+        except OSError as err:
+            if err.errno != errno.EIO:
+                raise
+            data = b""
+        if not data:
+            break
+        output += data
+    else:
+        banner = output.partition(prompt.encode("utf-8"))[0]
+        return pid, fd, banner.decode("utf-8", "ignore")
+    os.close(fd)
+    try:
+        os.kill(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    raise RuntimeError(f"{command[0]} did not start: {output[-1000:]!r}")
+
+
+class Pool:
+    """Prompt-ready gp processes for one command line and working directory."""
+
+    def __init__(self, command, prompt, cwd, env, size):
+        self.command = command
+        self.prompt = prompt
+        self.cwd = cwd
+        self.env = env
+        self.size = size
+        self.ready = []
+        self.failures = 0
+        self.wanted = threading.Condition()
+        self.closed = False
+        threading.Thread(target=self._refill, daemon=True).start()
+
+    def _refill(self):
+        while True:
+            with self.wanted:
+                while not self.closed and len(self.ready) >= self.size:
+                    self.wanted.wait()
+                if self.closed:
+                    return
+            try:
+                process = _fork_gp(self.command, self.prompt, self.cwd, self.env)
+            except (OSError, RuntimeError):
+                # do not spin on a broken command line
+                self.failures += 1
+                time.sleep(min(60, 2**self.failures))
+                continue
+            self.failures = 0
+            with self.wanted:
+                self.ready.append(process)
+
+    def claim(self):
+        with self.wanted:
+            while self.ready:
+                pid, fd, banner = self.ready.pop(0)
+                self.wanted.notify()
+                try:
+                    os.kill(pid, 0)
+                except ProcessLookupError:
+                    os.close(fd)
+                    continue
+                return pid, fd, banner
+            self.wanted.notify()
+        return None
+
+    def close(self):
+        with self.wanted:
+            self.closed = True
+            self.wanted.notify()
+            for pid, fd, _ in self.ready:
+                os.close(fd)
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+            self.ready = []
+
+
+class Supervisor:
+    def __init__(self, socket_path, size, idle_timeout):
+        self.socket_path = socket_path
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.pools = {}
+        self.last_claim = time.monotonic()
+
+    def handle(self, conn):
+        with conn:
+            # only serve processes of the same user
+            creds = conn.getsockopt(
+                socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")
+            )
+            if struct.unpack("3i", creds)[1] != os.getuid():
+                return
+            request, _ = _recv_json(conn)
+            key = (tuple(request["command"]), request["prompt"], request["cwd"])
+            if key not in self.pools:
+                self.pools[key] = Pool(
+                    request["command"],
+                    request["prompt"],
+                    request["cwd"],
+                    request["env"],
+                    self.size,
+                )
+            self.last_claim = time.monotonic()
+            process = self.pools[key].claim()
+            if process is None:
+                _send_json(conn, {})
+                return
+            pid, fd, banner = process
+            try:
+                _send_json(conn, {"pid": pid, "banner": banner}, [fd])
+            finally:
+                os.close(fd)
+
+    def serve(self):
+        lock = open(self.socket_path + ".lock", "w")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # somebody else is serving this socket
+            return
+        # the children are reaped automatically
+        signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        server.listen()
+        server.settimeout(60)
+        try:
+            while time.monotonic() - self.last_claim < self.idle_timeout:
+                try:
+                    conn, _ = server.accept()
+                except socket.timeout:
+                    continue
+                conn.setblocking(True)
+                try:
+                    self.handle(conn)
+                except (OSError, ValueError, KeyError):
+                    pass
+        finally:
+            os.unlink(self.socket_path)
+            server.close()
+            for pool in self.pools.values():
+                pool.close()
+            lock.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m gp_kernel.pool",
+        description="Keep prompt-ready gp processes for gp_kernel.",
+    )
+    parser.add_argument("--socket", default=default_socket_path())
+    parser.add_argument(
+        "--size", type=int, default=2, help="number of processes kept ready"
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=3600,
+        help="exit after that many seconds without claims",
+    )
+    args = parser.parse_args(argv)
+    Supervisor(args.socket, args.size, args.idle_timeout).serve()
+
+
+if __name__ == "__main__":
+    main()
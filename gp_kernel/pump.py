@@ -0,0 +1,145 @@
+import asyncio
+import codecs
+import errno
+import os
+import select
+import selectors
+import time
+
+from pexpect import EOF
+
+
+def partial_prompt(text, prompt):
+    """
+    Return the length of the longest suffix of `text` that is a proper prefix
+    of `prompt`.
+    """
+    if prompt[0] not in text[1 - len(prompt):]:
+        return 0
+    for k in range(min(len(text), len(prompt) - 1), 0, -1):
+        if text.endswith(prompt[:k]):
+            return k
+    return 0
+
+
+class OutputPump:
+    """
+    Forward gp's output to a callback until the prompt shows up.
+
+    Instead of polling pexpect every 0.1 seconds, we sleep on the pty file
+    descriptor and only wake up when gp writes something.  Output is coalesced
+    for at most `flush_interval` seconds, or until `chunk_size` characters are
+    waiting, before being handed to `on_output`, so a cell that prints line by
+    line does not produce one message per line, while the output that precedes
+    the prompt is always forwarded immediately.
+
+    Each chunk read from gp is forwarded exactly once and the prompt is only
+    searched for in the newly read text (plus the few characters before it
+    that could start the prompt), so the cost is linear in the size of the
+    output.  Nothing is retained once forwarded, so memory stays flat no
+    matter how much a cell prints.
+
+    `run` may be interrupted (e.g. by KeyboardInterrupt) and called again:
+    the pending output is kept on the instance.  `run_async` does the same
+    from an asyncio event loop, which keeps running while gp does.
+    """
+
+    def __init__(self, child, prompt, flush_interval=0.05, chunk_size=65536):
+        self.child = child
+        self.prompt = prompt
+        self.flush_interval = flush_interval
+        self.chunk_size = chunk_size
+        # output read but not yet forwarded
+        self.pending = ""
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        # whatever pexpect already read past the last prompt
+        if child.buffer:
+            self.pending = child.buffer
+            child.buffer = child.string_type()
+
+    def _read(self):
+        # read the pty directly, pexpect's read_nonblocking does two extra
+        # selects per call
+        try:
+            data = os.read(self.child.child_fd, self.chunk_size)
+        except OSError as err:
+            if err.errno != errno.EIO:
+                raise
+            data = b""
+        if not data:
+            self.child.flag_eof = True
+            raise EOF("End Of File (EOF).")
+        return self.decoder.decode(data)
+
+    def _feed(self, chunk):
+        """Add `chunk` to the pending output and return the prompt position."""
+        start = max(0, len(self.pending) - len(self.prompt) + 1)
+        self.pending += chunk
+        return self.pending.find(self.prompt, start)
+
+    def _steps(self, on_output):
+        """
+        Forward the output that can be, until the prompt.  Yield the time to
+        wait for gp (None for no limit), after which the caller reads what gp
+        wrote, if anything, with `_receive`.
+        """
+        last_flush = time.monotonic()
+        self.found = self.pending.find(self.prompt)
+        while True:
+            if self.found >= 0:
+                output = self.pending[: self.found]
+                self.pending = self.pending[self.found + len(self.prompt) :]
+                if output:
+                    on_output(output)
+                return
+
+            # hold back what could be the beginning of the prompt
+            ready = len(self.pending) - partial_prompt(self.pending, self.prompt)
+            now = time.monotonic()
+            if ready > 0 and (
+                now - last_flush >= self.flush_interval or ready >= self.chunk_size
+            ):
+                on_output(self.pending[:ready])
+                self.pending = self.pending[ready:]
+                last_flush = now
+                ready = 0
+
+            if ready > 0:
+                yield last_flush + self.flush_interval - now
+            else:
+                yield None
+
+    def _receive(self):
+        self.found = self._feed(self._read())
+
+    def run(self, on_output):
+        """
+        Block until gp prints the prompt, calling `on_output(text)` with the
+        output that precedes it.  Raises pexpect.EOF if gp dies.
+        """
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.child.child_fd, selectors.EVENT_READ)
+            for timeout in self._steps(on_output):
+                if selector.select(timeout):
+                    self._receive()
+
+    async def run_async(self, on_output):
+        """As `run`, waiting for gp in the running event loop."""
+        loop = asyncio.get_running_loop()
+        readable = asyncio.Event()
+        loop.add_reader(self.child.child_fd, readable.set)
+        try:
+            for timeout in self._steps(on_output):
+                readable.clear()
+                try:
+                    await asyncio.wait_for(readable.wait(), timeout)
+                except asyncio.TimeoutError:
+                    continue
+                # the reader may have been called for output that the last
+                # read took: reading would then block the event loop until
+                # gp writes again
+                if not select.select([self.child.child_fd], [], [], 0)[0]:
+                    continue
+                self._receive()
+        finally:
+            loop.remove_reader(self.child.child_fd)
@@ -0,0 +1,353 @@
+"""
+Running gp on another host, through an agent (see GPKernel.remote).
+
+The agent runs next to gp, e.g. on a compute node:
+
+    python -m gp_kernel.remote --listen 0.0.0.0:7340 --token-file ~/.gp_kernel_token
+
+and the kernel connects to it.  On its control connection it asks, in JSON
+lines, for a gp to be started or signalled, and for the files gp reads the
+cells from (gp cannot read the kernel's).  Each gp then gets a data
+connection of its own, which the agent relays to and from its pty: the
+kernel drives it like a local gp (RemoteGP), interrupts it with the
+interrupt character as a terminal does, and sees it exit as the end of the
+connection.  A gp whose data connection closes is killed, and so are all the
+ones of a control connection that closes.
+
+Whoever has the token can run gp, hence any command, as the user running the
+agent.  The traffic is not encrypted: listen on localhost and forward the
+port over ssh to cross a network.
+
+The kernel and gp need to share a filesystem for what gp itself reads or
+writes on behalf of the kernel (%checkpoint, %cache, %parmap).
+"""
+import argparse
+import hmac
+import itertools
+import json
+import os
+import select
+import signal
+import socket
+import threading
+from contextlib import contextmanager
+from tempfile import mkdtemp
+
+from pexpect.fdpexpect import fdspawn
+
+from .pool import _fork_gp
+from .transport import Cells, Transport
+
+
+def _send_line(sock, obj):
+    sock.sendall(json.dumps(obj).encode("utf-8") + b"\n")
+
+
+def _recv_line(sock, buffer):
+    """Read a JSON line from `sock`, past the bytes of `buffer` (a bytearray
+    keeping what follows the line)."""
+    while b"\n" not in buffer:
+        data = sock.recv(65536)
+        if not data:
+            raise ConnectionError("connection closed")
+        buffer += data
+    line, _, rest = bytes(buffer).partition(b"\n")
+    buffer[:] = rest
+    return json.loads(line.decode("utf-8"))
+
+
+def parse_address(address):
+    """(host, port) for "host:port"."""
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+class AgentClient:
+    """The control connection of a kernel to the agent at `address`."""
+
+    def __init__(self, address, token, timeout=120):
+        self.address = parse_address(address)
+        self.token = token
+        self.timeout = timeout
+        self.sock = None
+        self.buffer = bytearray()
+        self.lock = threading.Lock()
+
+    def _connect(self, **hello):
+        sock = socket.create_connection(self.address, self.timeout)
+        _send_line(sock, dict(hello, token=self.token))
+        return sock
+
+    def request(self, **request):
+        """Send `request`, return the reply.  Raises OSError."""
+        with self.lock:
+            if self.sock is None:
+                self.sock = self._connect(role="control")
+                self.buffer = bytearray()
+            try:
+                _send_line(self.sock, request)
+                reply = _recv_line(self.sock, self.buffer)
+            except (OSError, ValueError):
+                self.close()
+                raise ConnectionError("lost the connection to the gp agent")
+        if "error" in reply:
+            raise ConnectionError(f"gp agent: {reply['error']}")
+        return reply
+
+    def spawn(self, command, prompt, dimensions=None):
+        """Start gp with `command` (whose executable is the agent's choice)
+        and return (child, banner), the child at its first prompt."""
+        reply = self.request(
+            op="spawn", command=command, prompt=prompt, dimensions=dimensions
+        )
+        sock = self._connect(role="data", session=reply["session"])
+        # pexpect and OutputPump use the file descriptor, blocking
+        sock.settimeout(None)
+        child = RemoteGP(self, reply["session"], sock)
+        child.delaybeforesend = None
+        return child, reply["banner"]
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+class RemoteGP(fdspawn):
+    """
+    A gp run by the agent, driven through its data connection like a
+    pexpect.spawn child.  Its pid is not one of this host.
+    """
+
+    def __init__(self, client, session, sock):
+        fdspawn.__init__(self, sock.fileno(), encoding="utf-8", codec_errors="ignore")
+        self.client = client
+        self.session = session
+        self.sock = sock
+
+    def sendintr(self):
+        # the pty of gp turns it into SIGINT (gp keeps the default VINTR)
+        self.send("\x03")
+
+    def kill(self, sig):
+        try:
+            self.client.request(op="signal", session=self.session, signal=int(sig))
+        except OSError:
+            # gp goes with the connection to the agent
+            pass
+
+    def isalive(self):
+        return not self.flag_eof and self.child_fd != -1
+
+    def terminate(self, force=False):
+        self.kill(signal.SIGKILL if force else signal.SIGTERM)
+        self.close()
+        return True
+
+    def close(self, force=False):
+        # the agent kills gp when its data connection closes, so with force
+        # as without
+        if self.child_fd != -1:
+            self.sock.close()
+            self.child_fd = -1
+            self.closed = True
+
+
+class RemoteTransport(Transport):
+    """Write the cells to files of the agent, see transport.py."""
+
+    name = "remote"
+
+    def __init__(self, client):
+        self.client = client
+
+    @contextmanager
+    def cells(self, codes):
+        filenames = self.client.request(op="write", codes=codes)["filenames"]
+        try:
+            yield Cells(
+                filenames,
+                lambda i: self.client.request(op="truncate", filename=filenames[i]),
+            )
+        finally:
+            self.client.request(op="remove", filenames=filenames)
+
+
+class Agent:
+    """Serve the kernels connecting to `address` with `token`, running
+    `gp_executable`."""
+
+    def __init__(self, address, token, gp_executable):
+        self.address = parse_address(address)
+        self.token = token
+        self.gp_executable = gp_executable
+        self.sessions = {}
+        self.ids = itertools.count()
+        self.lock = threading.Lock()
+
+    def serve(self):
+        # the children are reaped automatically
+        signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+        server = socket.create_server(self.address)
+        print(f"gp_kernel agent listening on {server.getsockname()}", flush=True)
+        while True:
+            conn, _ = server.accept()
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        buffer = bytearray()
+        try:
+            hello = _recv_line(conn, buffer)
+            token = str(hello.get("token", ""))
+            if not hmac.compare_digest(token.encode(), self.token.encode()):
+                _send_line(conn, {"error": "wrong token"})
+                return
+            if hello.get("role") == "data":
+                self._relay(conn, hello["session"], bytes(buffer))
+            else:
+                self._control(conn, buffer)
+        except (OSError, ValueError, KeyError):
+            pass
+        finally:
+            conn.close()
+
+    def _control(self, conn, buffer):
+        directory = mkdtemp(prefix="gp_kernel_agent_")
+        files = itertools.count()
+        sessions = []
+        try:
+            while True:
+                request = _recv_line(conn, buffer)
+                op = request.get("op")
+                try:
+                    if op == "spawn":
+                        reply = self._spawn(request)
+                        sessions.append(reply["session"])
+                    elif op == "signal":
+                        self._signal(request["session"], request["signal"])
+                        reply = {}
+                    elif op == "write":
+                        filenames = []
+                        for code in request["codes"]:
+                            filename = os.path.join(directory, f"cell{next(files)}")
+                            with open(filename, "w", encoding="utf-8") as f:
+                                f.write(code)
+                            filenames.append(filename)
+                        reply = {"filenames": filenames}
+                    elif op == "truncate":
+                        self._check(request["filename"], directory)
+                        os.truncate(request["filename"], 0)
+                        reply = {}
+                    elif op == "remove":
+                        for filename in request["filenames"]:
+                            self._check(filename, directory)
+                            if os.path.exists(filename):
+                                os.unlink(filename)
+                        reply = {}
+                    else:
+                        reply = {"error": f"unknown request {op}"}
+                except (OSError, RuntimeError, KeyError, TypeError) as err:
+                    reply = {"error": str(err)}
+                _send_line(conn, reply)
+        except (OSError, ValueError):
+            pass
+        finally:
+            for session in sessions:
+                self._kill(session)
+            for filename in os.listdir(directory):
+                os.unlink(os.path.join(directory, filename))
+            os.rmdir(directory)
+
+    def _check(self, filename, directory):
+        if os.path.dirname(filename) != directory:
+            raise KeyError(f"not a file of this connection: {filename}")
+
+    def _spawn(self, request):
+        # the agent decides what runs, the kernel only chooses the arguments
+        command = [self.gp_executable] + [str(arg) for arg in request["command"][1:]]
+        pid, fd, banner = _fork_gp(
+            command,
+            request["prompt"],
+            os.getcwd(),
+            dict(os.environ),
+            dimensions=tuple(request.get("dimensions") or (24, 80)),
+        )
+        with self.lock:
+            session = str(next(self.ids))
+            self.sessions[session] = (pid, fd)
+        return {"session": session, "banner": banner}
+
+    def _signal(self, session, sig):
+        with self.lock:
+            pid, _ = self.sessions[session]
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def _kill(self, session):
+        """Kill the gp of `session` and close its pty."""
+        with self.lock:
+            pid, fd = self.sessions.pop(session, (None, None))
+        if pid is not None:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            os.close(fd)
+
+    def _relay(self, conn, session, data):
+        """Copy between the data connection and the pty of gp until either
+        ends, then kill gp."""
+        with self.lock:
+            _, fd = self.sessions[session]
+        try:
+            if data:
+                os.write(fd, data)
+            while True:
+                readable, _, _ = select.select([conn, fd], [], [])
+                if conn in readable:
+                    data = conn.recv(65536)
+                    if not data:
+                        break
+                    os.write(fd, data)
+                if fd in readable:
+                    try:
+                        data = os.read(fd, 65536)
+                    except OSError:
+                        # EIO: gp exited
+                        data = b""
+                    if not data:
+                        break
+                    conn.sendall(data)
+        finally:
+            self._kill(session)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m gp_kernel.remote",
+        description="Run gp for gp_kernel kernels connecting over TCP.",
+    )
+    parser.add_argument(
+        "--listen", default="127.0.0.1:7340", help="host:port to listen on"
+    )
+    parser.add_argument(
+        "--token-file",
+        help="file holding the token the kernels must send, by default "
+        "$GP_KERNEL_REMOTE_TOKEN",
+    )
+    parser.add_argument("--gp", default="gp", help="the gp executable")
+    args = parser.parse_args(argv)
+    if args.token_file:
+        with open(args.token_file, encoding="utf-8") as f:
+            token = f.read().strip()
+    else:
+        token = os.environ.get("GP_KERNEL_REMOTE_TOKEN", "")
+    if not token:
+        parser.error("a token is needed, see --token-file")
+    Agent(args.listen, token, args.gp).serve()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+The results of the cells marked with %cache (see GPKernel.magic_cache).
+
+An entry is keyed on the code of the cell, the gp version and the defaults
+the result depends on.  It holds the variables the cell set, written by gp
+with `writebin` (one file each), and the output of the cell, so that a hit
+only takes a `read` per variable.
+
+The cache directory can be shared by several kernels: an entry is built in a
+directory of its own and renamed into place, and the one evicting the least
+recently used entries, once the cache outgrows its size, holds a lock.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import time
+from tempfile import mkdtemp
+
+# the name of an entry holding its variables, output and size
+manifest_name = "manifest.json"
+
+
+def cache_key(code, version, defaults):
+    """The key of the cell `code`, run by gp `version` with `defaults`."""
+    data = json.dumps([code, version, sorted(defaults.items())])
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+
+    def lookup(self, key):
+        """
+        The entry of `key`, as a dict with the "output" and "files" (name ->
+        file) of the cell, or None.
+        """
+        manifest = os.path.join(self.directory, key, manifest_name)
+        try:
+            with open(manifest, encoding="utf-8") as f:
+                entry = json.load(f)
+            # the time of last use, for the eviction
+            os.utime(manifest)
+        except (OSError, ValueError):
+            return None
+        entry["files"] = {
+            name: os.path.join(self.directory, key, filename)
+            for name, filename in entry["files"].items()
+        }
+        return entry
+
+    def new_entry(self):
+        """A directory to write a new entry to, see `commit`."""
+        os.makedirs(self.directory, exist_ok=True)
+        return mkdtemp(prefix=".new-", dir=self.directory)
+
+    def commit(self, key, directory, output):
+        """
+        Make the files written to `directory` (from `new_entry`), one per
+        variable and named after it, and `output` the entry of `key`.
+        """
+        files = {}
+        size = 0
+        for filename in os.listdir(directory):
+            files[filename[: -len(".bin")]] = filename
+            size += os.path.getsize(os.path.join(directory, filename))
+        entry = {"files": files, "output": output, "size": size + len(output)}
+        with open(os.path.join(directory, manifest_name), "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        try:
+            os.rename(directory, os.path.join(self.directory, key))
+        except OSError:
+            # another kernel stored it first
+            shutil.rmtree(directory, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        """Drop the least recently used entries past max_size."""
+        with open(os.path.join(self.directory, ".lock"), "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                # another kernel is at it
+                return
+            entries = []
+            for key in os.listdir(self.directory):
+                path = os.path.join(self.directory, key)
+                if key.startswith("."):
+                    # left behind by a kernel that died
+                    stale = time.time() - os.path.getmtime(path) > 86400
+                    if os.path.isdir(path) and stale:
+                        shutil.rmtree(path, ignore_errors=True)
+                    continue
+                manifest = os.path.join(path, manifest_name)
+                try:
+                    with open(manifest, encoding="utf-8") as f:
+                        size = json.load(f)["size"]
+                    entries.append((os.path.getmtime(manifest), size, path))
+                except (OSError, ValueError, KeyError):
+                    continue
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_size:
+                    break
+                # readers see the entry gone at once
+                dropped = mkdtemp(prefix=".old-", dir=self.directory)
+                os.rename(path, os.path.join(dropped, "entry"))
+                shutil.rmtree(dropped, ignore_errors=True)
+                total -= size
@@ -0,0 +1,391 @@
+"""
+Running notebooks and gp scripts without Jupyter:
+
+    python -m gp_kernel run [-j N] [--output-dir DIR] [--junit FILE] FILE...
+
+Each file is run by a GPKernel of its own, driven directly as in
+benchmarks/bench_kernel.py (without ZMQ or a kernel manager): the code cells
+of a notebook go one after the other through do_execute, so that the magics,
+the time and memory limits and the error replies are those of the notebook,
+and a .gp file is run as a single cell.  With --batch, the cells of a
+notebook are sent to gp at once instead (see GPKernel.execute_batch), unless
+they need do_execute for a magic or a limit.  N files run at once, each in a
+thread driving its own gp.
+
+The options of the kernel are given as for the kernel, e.g.
+--GPKernel.parisizemax=4G, or in the GP_KERNEL_* environment variables.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from traitlets.config.loader import KVArgParseConfigLoader
+
+from .checkpoint import gp_string
+from .completion import cache_dir
+from .kernel import GPKernel, split_magics
+
+
+class RunnerKernel(GPKernel):
+    """A GPKernel keeping the output of the cell it runs instead of sending
+    it to a frontend."""
+
+    def send_response(self, stream, msg_or_type, content=None, *args, **kwargs):
+        if msg_or_type == "stream":
+            self.output.append(content["text"])
+
+    output = []
+
+    def run_cell(self, code):
+        """Run a cell as for an execute_request: return (reply, output)."""
+        self.output = []
+        self.execution_count += 1
+        reply = self.loop.run_until_complete(self.do_execute(code, False))
+        return reply, "".join(self.output)
+
+    def can_batch(self, cells):
+        """Whether `cells` can run with `run_batch`: no magics, time or
+        memory limits, which only do_execute knows of."""
+        if (
+            self.cell_timeout > 0
+            or self.memory_soft_limit > 0
+            or self.memory_hard_limit > 0
+        ):
+            return False
+        return not any(split_magics(code, self._magics())[0] for code in cells)
+
+    def run_batch(self, cells):
+        """Run `cells` in a single round trip to gp: return (reply, output,
+        wall time) for each cell gp ran, see GPKernel.execute_batch."""
+        results = self.loop.run_until_complete(self.execute_batch(cells))
+        ran = []
+        for result in results:
+            self.execution_count += 1
+            reply = {
+                "status": result["status"],
+                "execution_count": self.execution_count,
+            }
+            if result["status"] == "error":
+                for field in ("ename", "evalue", "traceback"):
+                    reply[field] = result[field]
+            ran.append((reply, result["output"], result["wall_time"]))
+        return ran
+
+
+class Result:
+    """What running a file gave: per cell, its reply, output and wall time."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.cells = []
+        self.skipped = 0
+        # a failure to read or run the file itself
+        self.error = None
+        self.time = 0.0
+
+    @property
+    def failed_cell(self):
+        """The number (from 1) of the first cell that failed, or None."""
+        for number, (reply, _, _) in enumerate(self.cells, 1):
+            if reply["status"] != "ok":
+                return number
+        return None
+
+    @property
+    def ok(self):
+        return self.error is None and self.failed_cell is None
+
+
+def read_cells(filename):
+    """The notebook (or None for a .gp file) and the code of its cells."""
+    with open(filename, encoding="utf-8") as f:
+        if not filename.endswith(".ipynb"):
+            return None, [f.read()]
+        notebook = json.load(f)
+    cells = [
+        "".join(cell["source"]) if isinstance(cell["source"], list) else cell["source"]
+        for cell in notebook["cells"]
+        if cell["cell_type"] == "code"
+    ]
+    return notebook, cells
+
+
+def cell_outputs(reply, output):
+    """The outputs of a notebook cell, in nbformat 4."""
+    outputs = []
+    if output:
+        outputs.append({"output_type": "stream", "name": "stdout", "text": output})
+    if reply["status"] == "error":
+        outputs.append(
+            {
+                "output_type": "error",
+                "ename": reply["ename"],
+                "evalue": reply["evalue"],
+                "traceback": reply["traceback"],
+            }
+        )
+    return outputs
+
+
+class Runner:
+    """Run files with the kernel options `config`, `jobs` at a time."""
+
+    def __init__(self, config, jobs, allow_errors=False, output_dir=None, batch=False):
+        self.config = config
+        self.jobs = jobs
+        self.allow_errors = allow_errors
+        self.output_dir = output_dir
+        self.batch = batch
+        # the kernels running, by thread, to interrupt them
+        self.kernels = {}
+        self.stopped = False
+        self.lock = threading.Lock()
+
+    def run(self, filenames, report):
+        """Run `filenames`, calling `report` with each Result as it comes,
+        and return the Results in the order of `filenames`."""
+        results = [None] * len(filenames)
+        executor = ThreadPoolExecutor(self.jobs)
+        futures = {
+            executor.submit(self.run_file, name): i for i, name in enumerate(filenames)
+        }
+        try:
+            for future in as_completed(futures):
+                result = future.result()
+                results[futures[future]] = result
+                report(result)
+        except KeyboardInterrupt:
+            self.stop()
+            raise
+        finally:
+            executor.shutdown(cancel_futures=True)
+        return results
+
+    def stop(self):
+        """Interrupt the cells running, and run no more."""
+        self.stopped = True
+        with self.lock:
+            kernels = list(self.kernels.values())
+        for kernel in kernels:
+            kernel.loop.call_soon_threadsafe(kernel._interrupt, None, None)
+
+    def run_file(self, filename):
+        result = Result(filename)
+        start = time.monotonic()
+        kernel = None
+        try:
+            notebook, cells = read_cells(filename)
+            kernel = self._kernel(filename)
+            if self.batch and not self.stopped and kernel.can_batch(cells):
+                # gp runs the cells after a failed one too
+                result.cells = kernel.run_batch(cells)
+                result.skipped = len(cells) - len(result.cells)
+                cells = []
+            for code in cells:
+                if self.stopped or (result.failed_cell and not self.allow_errors):
+                    result.skipped += 1
+                    continue
+                cell_start = time.monotonic()
+                reply, output = kernel.run_cell(code)
+                result.cells.append((reply, output, time.monotonic() - cell_start))
+            if self.output_dir is not None:
+                self._write(filename, notebook, result)
+        except Exception as err:
+            result.error = f"{type(err).__name__}: {err}"
+        finally:
+            if kernel is not None:
+                self._shutdown(kernel)
+        result.time = time.monotonic() - start
+        return result
+
+    def _kernel(self, filename):
+        """A kernel with a gp of its own to run `filename`, reading files
+        from the directory of `filename` first."""
+        # the checkpoints of a notebook are its own, as in Jupyter
+        key = hashlib.sha1(os.path.abspath(filename).encode("utf-8")).hexdigest()[:16]
+        options = {}
+        if "checkpoint_dir" not in self.config.GPKernel:
+            options["checkpoint_dir"] = cache_dir("checkpoints", key)
+        kernel = RunnerKernel(config=self.config, **options)
+        kernel.loop = asyncio.new_event_loop()
+        with self.lock:
+            self.kernels[threading.get_ident()] = kernel
+        directory = os.path.dirname(os.path.abspath(filename))
+        kernel._run_lines(
+            f'default(path, Str({gp_string(directory)}, ":", default(path)))'
+        )
+        return kernel
+
+    def _shutdown(self, kernel):
+        with self.lock:
+            self.kernels.pop(threading.get_ident(), None)
+        # kills gp
+        kernel.do_shutdown(False)
+        kernel.loop.close()
+
+    def _write(self, filename, notebook, result):
+        """Write the executed notebook, or the output of the .gp file (as
+        <name>.out), to output_dir."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        target = os.path.join(self.output_dir, os.path.basename(filename))
+        if notebook is None:
+            output = result.cells[0][1] if result.cells else ""
+            with open(target + ".out", "w", encoding="utf-8") as f:
+                f.write(output)
+            return
+        code_cells = [cell for cell in notebook["cells"] if cell["cell_type"] == "code"]
+        for cell in code_cells:
+            cell["outputs"] = []
+            cell["execution_count"] = None
+        for cell, (reply, output, _) in zip(code_cells, result.cells):
+            cell["outputs"] = cell_outputs(reply, output)
+            cell["execution_count"] = reply["execution_count"]
+        with open(target, "w", encoding="utf-8") as f:
+            json.dump(notebook, f, indent=1, ensure_ascii=False)
+            f.write("\n")
+
+
+def junit_report(results, elapsed):
+    """A JUnit XML report of `results`: a testsuite per file, a testcase per
+    cell."""
+    suites = ET.Element("testsuites", name="gp_kernel", time=f"{elapsed:.3f}")
+    tests = failures = errors = 0
+    for result in results:
+        name = result.filename
+        suite = ET.SubElement(suites, "testsuite", name=name, time=f"{result.time:.3f}")
+        suite_failures = 0
+        for number, (reply, output, wall_time) in enumerate(result.cells, 1):
+            case = ET.SubElement(
+                suite,
+                "testcase",
+                classname=name,
+                name=f"cell {number}",
+                time=f"{wall_time:.3f}",
+            )
+            if reply["status"] == "error":
+                failure = ET.SubElement(
+                    case, "failure", type=reply["ename"], message=reply["evalue"]
+                )
+                failure.text = "\n".join(reply["traceback"])
+                suite_failures += 1
+            elif reply["status"] != "ok":
+                ET.SubElement(case, "failure", type="abort", message="Interrupted")
+                suite_failures += 1
+            if output:
+                ET.SubElement(case, "system-out").text = output
+        first = len(result.cells) + 1
+        for number in range(first, first + result.skipped):
+            case = ET.SubElement(
+                suite, "testcase", classname=name, name=f"cell {number}", time="0"
+            )
+            ET.SubElement(case, "skipped", message="after a failed cell")
+        suite_errors = 0
+        if result.error is not None:
+            case = ET.SubElement(suite, "testcase", classname=name, name=name, time="0")
+            ET.SubElement(case, "error", message=result.error)
+            suite_errors = 1
+        cases = len(result.cells) + result.skipped + suite_errors
+        suite.set("tests", str(cases))
+        suite.set("failures", str(suite_failures))
+        suite.set("errors", str(suite_errors))
+        suite.set("skipped", str(result.skipped))
+        tests += cases
+        failures += suite_failures
+        errors += suite_errors
+    suites.set("tests", str(tests))
+    suites.set("failures", str(failures))
+    suites.set("errors", str(errors))
+    ET.indent(suites)
+    return ET.ElementTree(suites)
+
+
+def summary(result):
+    """The line printed for `result`."""
+    line = f"{'ok' if result.ok else 'FAIL':4} {result.time:8.2f}s  {result.filename}"
+    if result.error is not None:
+        return f"{line}  ({result.error})"
+    detail = f"{len(result.cells)} cell{'s' if len(result.cells) != 1 else ''}"
+    failed = result.failed_cell
+    if failed is not None:
+        reply = result.cells[failed - 1][0]
+        detail += f", cell {failed}: {reply.get('ename', 'interrupted')}"
+    if result.skipped:
+        detail += f", {result.skipped} skipped"
+    return f"{line}  ({detail})"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m gp_kernel run",
+        description="Run notebooks and .gp files with gp, without Jupyter.",
+        epilog="Other options, e.g. --GPKernel.parisizemax=4G, are passed to "
+        "the kernels.",
+    )
+    parser.add_argument("files", nargs="+", help="notebooks (.ipynb) and gp scripts")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of files run at once (one gp each), one per cpu by default",
+    )
+    parser.add_argument(
+        "--output-dir",
+        help="write the executed notebooks, and the output of the gp scripts "
+        "(as <name>.out), to this directory",
+    )
+    parser.add_argument("--junit", help="write a JUnit XML report to this file")
+    parser.add_argument(
+        "--allow-errors",
+        action="store_true",
+        help="run the cells after a failed one",
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="send the cells of each notebook to gp at once, and run them all "
+        "as with --allow-errors (but the notebooks with magics, and with "
+        "--timeout or memory limits)",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        help="time limit of each cell in seconds (GPKernel.cell_timeout)",
+    )
+    args, options = parser.parse_known_args(argv)
+    unknown = [option for option in options if not option.startswith("--GPKernel.")]
+    if unknown:
+        parser.error(f"unrecognized arguments: {' '.join(unknown)}")
+    config = KVArgParseConfigLoader(options).load_config()
+    if args.timeout is not None:
+        config.GPKernel.cell_timeout = args.timeout
+
+    runner = Runner(
+        config, max(1, args.jobs), args.allow_errors, args.output_dir, args.batch
+    )
+    start = time.monotonic()
+    try:
+        results = runner.run(
+            args.files, lambda result: print(summary(result), flush=True)
+        )
+    except KeyboardInterrupt:
+        return 130
+    elapsed = time.monotonic() - start
+    failed = sum(not result.ok for result in results)
+    print(f"{len(results)} files, {failed} failed, in {elapsed:.2f}s")
+    if args.junit:
+        junit_report(results, elapsed).write(
+            args.junit, encoding="utf-8", xml_declaration=True
+        )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
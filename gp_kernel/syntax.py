@@ -0,0 +1,151 @@
+"""
+Whether the input of a cell is complete, for GPKernel.do_is_complete.
+
+Line-based frontends (jupyter console) ask before sending what was typed.
+gp reads its input a line at a time, but joins the next line to one that
+leaves a `{` or a `/* */` comment open, ends with `\\`, or whose last
+character (but for comments) is `=`, as in `f(x) =` followed by the body on
+the next lines.  A line leaving a `(`, a `[` or a string open is an error in
+gp, not continued.  The scanner knows enough of gp's lexical grammar to
+tell, without gp.  It is incremental: the frontend asks again for the same
+input with a new line, and only the new text is scanned.
+"""
+import copy
+
+from .completion import inert
+
+closing = {"(": ")", "[": "]", "{": "}"}
+
+
+class Scanner:
+    def __init__(self):
+        # the open brackets
+        self.stack = []
+        # "string", "comment" (/* */), "line" (\\ comment) or None
+        self.mode = None
+        self.prev = None
+        # the last character of the line but for blanks and comments, and
+        # the one before it
+        self.last = None
+        self.before = None
+        # gp joins the next line to this one
+        self.continued = False
+        self.invalid = False
+        self.text = ""
+
+    def feed(self, text):
+        self.text += text
+        for c in text:
+            prev, self.prev = self.prev, c
+            if self.mode == "string":
+                if prev == "\\":
+                    # escaped, and does not escape the next one
+                    self.prev = None
+                elif c == '"':
+                    self.mode = None
+                elif c == "\n" and "{" not in self.stack:
+                    # a run-away string
+                    self._end_line(None)
+                    self.mode = None
+            elif self.mode == "comment":
+                if prev == "*" and c == "/":
+                    self.mode = None
+                    self.prev = None
+            elif self.mode == "line":
+                if c == "\n":
+                    self.mode = None
+                    self._end_line(None)
+            elif c == "\n":
+                self._end_line(prev)
+            elif c in " \t\r":
+                pass
+            else:
+                self.continued = False
+                before, self.last = self.last, c
+                if c == '"':
+                    self.mode = "string"
+                elif prev == "/" and c == "*":
+                    self.mode = "comment"
+                    self.prev = None
+                    self.last = before = self.before
+                elif prev == "\\" and c == "\\":
+                    self.mode = "line"
+                    self.last = before = self.before
+                elif c in closing:
+                    self.stack.append(c)
+                elif c in ")]}":
+                    if not self.stack or closing[self.stack.pop()] != c:
+                        self.invalid = True
+                self.before = before
+
+    def _end_line(self, prev):
+        """The end of a line, `prev` its last character outside comments."""
+        self.continued = prev == "\\" or self.last == "="
+        if self.continued or "{" in self.stack:
+            return
+        # gp reads the line as it is
+        if self.stack or self.mode == "string":
+            self.invalid = True
+        self.stack = []
+        self.last = self.before = None
+
+    def resume(self, text):
+        """A scanner of `text`, starting from this one if `text` extends what
+        it scanned."""
+        if not text.startswith(self.text):
+            scanner = Scanner()
+        else:
+            scanner = copy.copy(self)
+            scanner.stack = list(self.stack)
+            text = text[len(self.text) :]
+        scanner.feed(text)
+        return scanner
+
+    def status(self):
+        """
+        "complete", "incomplete" (gp would wait for the next line) or
+        "invalid" (a bracket closed that was not open, or left open at the
+        end of a line), and the indent of the next line.
+        """
+        indent = "  " * len(self.stack)
+        if self.mode == "comment" or "{" in self.stack or self.continued:
+            return "incomplete", indent
+        if self.mode != "string" and self.last == "=":
+            return "incomplete", indent
+        if self.mode is None and self.prev == "\\":
+            return "incomplete", indent
+        if self.invalid or self.stack or self.mode == "string":
+            return "invalid", ""
+        return "complete", ""
+
+
+def statement_starts(code):
+    """The offsets of the lines of `code` starting a top-level statement (a
+    line, or the lines up to the closing of a bracket or string)."""
+    scanner = Scanner()
+    starts = []
+    offset = 0
+    for line in code.split("\n"):
+        if scanner.status()[0] != "incomplete":
+            starts.append(offset)
+        scanner.feed(line + "\n")
+        offset += len(line) + 1
+    return starts
+
+
+def one_line(code):
+    """
+    `code` as a single line of gp input (gp runs each line on its own): the
+    comments are dropped, the newlines of strings escaped, and the other
+    ones joined.  None if the line would leave gp waiting for more.
+    """
+    code = code.replace("\r\n", "\n").replace("\r", "\n")
+    code = inert.sub(
+        lambda m: m[0].replace("\n", "\\n") if m[0].startswith('"') else " ", code
+    )
+    code = code.replace("\\\n", "").replace("\n", " ")
+    scanner = Scanner()
+    scanner.feed(code)
+    if scanner.status()[0] != "complete":
+        return None
+    return code
@@ -0,0 +1,169 @@
+"""
+How the code of a cell reaches gp.
+
+gp is always asked to read the cell with `\\r <filename>`: entering the code
+directly at the prompt gives a different number of prompts depending on the
+code.  The transports only differ in what `<filename>` is.
+
+Several cells can be queued at once (see GPKernel.execute_batch): all the
+files exist before gp reads the first one, and the cells that have not been
+read yet can be cancelled, after which gp reads them as empty.
+"""
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from tempfile import NamedTemporaryFile, mkdtemp
+
+
+class Transport:
+    @contextmanager
+    def cell(self, code):
+        """Provide the file name gp reads `code` from."""
+        with self.cells([code]) as cells:
+            yield cells.filenames[0]
+
+    def cells(self, codes):
+        """
+        Context manager providing an object with the attribute `filenames`
+        (one per code) and the method `cancel(i)`, which empties the i-th
+        file if gp did not start reading it.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class Cells:
+    def __init__(self, filenames, cancel):
+        self.filenames = filenames
+        self.cancel = cancel
+
+
+class TempFileTransport(Transport):
+    """Write each cell to a new temporary file, synced to disk."""
+
+    name = "tempfile"
+
+    @contextmanager
+    def cells(self, codes):
+        tmpfiles = [NamedTemporaryFile("w+t") for _ in codes]
+        try:
+            for tmpfile, code in zip(tmpfiles, codes):
+                tmpfile.write(code)
+                tmpfile.flush()
+                os.fsync(tmpfile.fileno())
+            yield Cells(
+                [tmpfile.name for tmpfile in tmpfiles],
+                lambda i: tmpfiles[i].truncate(0),
+            )
+        finally:
+            for tmpfile in tmpfiles:
+                tmpfile.close()
+
+
+class MemfdTransport(Transport):
+    """
+    Keep a single anonymous in-memory file (Linux only), overwritten by each
+    cell, that gp reads through /proc.  Nothing touches the disk.
+    """
+
+    name = "memfd"
+
+    def __init__(self):
+        self.fd = os.memfd_create("gp_kernel_cell")
+
+    def _filename(self, fd):
+        return f"/proc/{os.getpid()}/fd/{fd}"
+
+    @contextmanager
+    def cells(self, codes):
+        # further cells get their own file
+        fds = [self.fd] + [os.memfd_create("gp_kernel_cell") for _ in codes[1:]]
+        try:
+            for fd, code in zip(fds, codes):
+                data = code.encode("utf-8")
+                os.ftruncate(fd, 0)
+                os.pwrite(fd, data, 0)
+            yield Cells(
+                [self._filename(fd) for fd in fds], lambda i: os.ftruncate(fds[i], 0)
+            )
+        finally:
+            for fd in fds[1:]:
+                os.close(fd)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FifoTransport(Transport):
+    """
+    Keep a named pipe that gp reads each cell from (and one more per further
+    cell queued at once).
+
+    Opening a pipe for writing blocks until gp opens it, and gp evaluates the
+    cell while reading it, so the code is written from a thread.
+    """
+
+    name = "fifo"
+
+    def __init__(self):
+        self.directory = mkdtemp(prefix="gp_kernel_")
+        self.filenames = []
+
+    def _fifos(self, n):
+        while len(self.filenames) < n:
+            filename = os.path.join(self.directory, f"cell{len(self.filenames)}")
+            os.mkfifo(filename, 0o600)
+            self.filenames.append(filename)
+        return self.filenames[:n]
+
+    def _write(self, filenames, codes, cancelled):
+        for i, (filename, code) in enumerate(zip(filenames, codes)):
+            try:
+                with open(filename, "wb") as fifo:
+                    if i not in cancelled:
+                        fifo.write(code.encode("utf-8"))
+            except BrokenPipeError:
+                # gp stopped reading (error or death)
+                pass
+
+    @contextmanager
+    def cells(self, codes):
+        filenames = self._fifos(len(codes))
+        cancelled = set()
+        writer = threading.Thread(
+            target=self._write, args=(filenames, codes, cancelled), daemon=True
+        )
+        writer.start()
+        try:
+            yield Cells(filenames, cancelled.add)
+        finally:
+            if writer.is_alive():
+                # gp did not read every cell (interrupted or dead), open the
+                # pipes it did not so that the writer finishes
+                cancelled.update(range(len(codes)))
+                fds = [
+                    os.open(filename, os.O_RDONLY | os.O_NONBLOCK)
+                    for filename in filenames
+                ]
+                try:
+                    while writer.is_alive():
+                        for fd in fds:
+                            try:
+                                os.read(fd, 65536)
+                            except BlockingIOError:
+                                pass
+                        writer.join(0.01)
+                finally:
+                    for fd in fds:
+                        os.close(fd)
+
+    def close(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+transports = {
+    t.name: t for t in [TempFileTransport, MemfdTransport, FifoTransport]
+}
@@ -20,17 +20,43 @@ kernel_json = {
 }
 
 
+def profile_kernel_json(profile):
+    """
+    The kernelspec of a launch profile, e.g.
+
+        {"name": "gp-8t-4g", "display_name": "PARI/GP (8 threads, 4 GB)",
+         "config": {"nbthreads": 8, "parisizemax": "4G"}}
+
+    where config holds GPKernel options.
+    """
+    spec = dict(kernel_json, display_name=profile["display_name"])
+    spec["argv"] = kernel_json["argv"] + [
+        f"--GPKernel.{key}={value}" for key, value in profile.get("config", {}).items()
+    ]
+    return spec
+
+
 class CustomHook(BuildHookInterface):
     def initialize(self, version, build_data):
         here = os.path.abspath(os.path.dirname(__file__))
         sys.path.insert(0, here)
         prefix = os.path.join(here, 'data_kernelspec')
 
+        # further kernelspecs, side by side with the default one, are listed in
+        # [tool.hatch.build.hooks.custom] profiles = [...] in pyproject.toml
+        specs = [('gp', kernel_json)]
+        for profile in self.config.get('profiles', []):
+            specs.append((profile['name'], profile_kernel_json(profile)))
+
+        for name, spec in specs:
+            self.install_kernel_spec(name, spec, prefix)
+
+    def install_kernel_spec(self, name, spec, prefix):
         with TemporaryDirectory() as td:
             os.chmod(td, 0o755) # Starts off as 700, not user readable
             with open(os.path.join(td, 'kernel.json'), 'w') as f:
-                json.dump(kernel_json, f, sort_keys=True)
-            print('Installing Jupyter kernel spec')
+                json.dump(spec, f, sort_keys=True)
+            print(f'Installing Jupyter kernel spec {name}')
 
             # Requires logo files in kernel root directory
             cur_path = os.path.dirname(os.path.realpath(__file__))
@@ -40,4 +66,4 @@ class CustomHook(BuildHookInterface):
                 except FileNotFoundError:
                     print("Custom logo files not found. Default logos will be used.")
 
-            KernelSpecManager().install_kernel_spec(td, 'gp', user=False, prefix=prefix)
+            KernelSpecManager().install_kernel_spec(td, name, user=False, prefix=prefix)
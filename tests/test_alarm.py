@@ -0,0 +1,122 @@
+import asyncio
+import shutil
+
+import pytest
+
+from gp_kernel.alarm import AlarmFilter, alarm_prefix, hide_alarm, time_limited
+from gp_kernel.runner import RunnerKernel
+
+deadline = 1792316683810
+prefix = alarm_prefix(deadline)
+
+
+def test_prefix_rounds_up():
+    assert prefix == "alarm(max(1,(1792316683810-getwalltime()+999)\\1000));"
+
+
+@pytest.mark.parametrize(
+    "code, expected",
+    [
+        ("1+1", "P1+1"),
+        ("a=1;b=2", "Pa=1;b=2"),
+        ("a=1\nb=2\n", "Pa=1\nPb=2\n"),
+        ("\\p 50\nx=1", "\\p 50\nPx=1"),
+        ("?sin\nx=1", "?sin\nPx=1"),
+        ("f(x)=\\\n  x^2\ny", "Pf(x)=\\\n  x^2\nPy"),
+        ("{\na=1;\nb=2\n}\nc", "P{\na=1;\nb=2\n}\nPc"),
+        ("f(x) =\n{\n  x^2\n}\ny", "Pf(x) =\n{\n  x^2\n}\nPy"),
+        ("a =\n  5\nb", "Pa =\n  5\nPb"),
+        ("\n\nx", "\n\nPx"),
+    ],
+)
+def test_time_limited(code, expected):
+    assert time_limited(code, deadline) == expected.replace("P", prefix)
+
+
+@pytest.mark.skipif(shutil.which("gp") is None, reason="needs gp")
+def test_definitions_unchanged(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    kernel = RunnerKernel()
+    kernel.loop = asyncio.new_event_loop()
+    try:
+        reply, _ = kernel.run_cell("%timeout 5\nf(x) =\n{\n  x^2\n}\na =\n  5")
+        assert reply["status"] == "ok"
+        reply, output = kernel.run_cell("print(f); print(a)")
+        assert output.split() == ["(x)->x^2", "5"]
+    finally:
+        kernel.do_shutdown(False)
+        kernel.loop.close()
+
+
+@pytest.mark.parametrize(
+    "output, expected",
+    [
+        # the whole prefix shown
+        (
+            f"  ***   at top-level: {prefix}while(1,)\r\n"
+            f"  ***                 {' ' * len(prefix)}^---------\r\n"
+            "  *** while: alarm interrupt after 984 ms.\r\n",
+            "  ***   at top-level: while(1,)\r\n"
+            "  ***                 ^---------\r\n"
+            "  *** while: alarm interrupt after 984 ms.\r\n",
+        ),
+        # the start elided, in the middle of "\1000));"
+        (
+            "  ***   at top-level: ...1000));s=0;for(i=1,10^9,s+=i)\r\n"
+            "  ***                                             ^----\r\n"
+            "  ***   alarm interrupt after 903 ms.\r\n",
+            "  ***   at top-level: s=0;for(i=1,10^9,s+=i)\r\n"
+            "  ***                                   ^----\r\n"
+            "  ***   alarm interrupt after 903 ms.\r\n",
+        ),
+        # the start elided, before "\1000));"
+        (
+            "  ***   at top-level: ...+999)\\1000));x=0;while(1,x++)\r\n"
+            "  ***                                             ^----\r\n"
+            "  ***   alarm interrupt after 1,981 ms.\r\n",
+            "  ***   at top-level: x=0;while(1,x++)\r\n"
+            "  ***                             ^----\r\n"
+            "  ***   alarm interrupt after 1,981 ms.\r\n",
+        ),
+        # the end cut: only the prefix shown
+        (
+            "  ***   at top-level: alarm(max(1,(1792316683810-getwalltime()+999)\\\r\n"
+            "  ***                 ^----------------------------------------------\r\n"
+            "  ***   alarm interrupt after 1,983 ms.\r\n",
+            "  ***   at top-level: ...\r\n"
+            "  ***                 ^---\r\n"
+            "  ***   alarm interrupt after 1,983 ms.\r\n",
+        ),
+        # the caret before the code
+        (
+            f"  ***   at top-level: {prefix}x\r\n  ***   ^\r\n",
+            "  ***   at top-level: x\r\n  ***   ^\r\n",
+        ),
+        # no caret line
+        (f"  ***   at top-level: {prefix}x", "  ***   at top-level: x"),
+        # other errors, and an elision in the code of the cell
+        (
+            "  ***   at top-level: ...,2,3,4,5,6,7,8,9,10,11,12,13,14,15]+1\r\n"
+            "  ***                                                        ^--\r\n",
+            "  ***   at top-level: ...,2,3,4,5,6,7,8,9,10,11,12,13,14,15]+1\r\n"
+            "  ***                                                        ^--\r\n",
+        ),
+        ("1\r\n%2 = 3\r\n", "1\r\n%2 = 3\r\n"),
+    ],
+)
+def test_hide_alarm(output, expected):
+    assert hide_alarm(output, prefix) == expected
+
+
+def test_filter_holds_context_lines():
+    output = (
+        "x\r\n  ***   at top-level: ...1000));s=0;for(i=1,10^9,s+=i)\r\n"
+        "  ***                                             ^----\r\n"
+        "  ***   alarm interrupt after 903 ms.\r\n"
+    )
+    expected = hide_alarm(output, prefix)
+    for size in [1, 2, 7, 30]:
+        alarm_filter = AlarmFilter(prefix)
+        chunks = [output[i : i + size] for i in range(0, len(output), size)]
+        shown = "".join(alarm_filter.feed(chunk) for chunk in chunks)
+        assert shown + alarm_filter.close() == expected
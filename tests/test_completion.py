@@ -0,0 +1,49 @@
+import pytest
+
+from gp_kernel.checkpoint import changed_names
+from gp_kernel.completion import definitions, defines_indirectly
+
+
+@pytest.mark.parametrize(
+    "code, names, members",
+    [
+        ("x = 1", {"x"}, set()),
+        ("f(t) = t^2; g(u,v)=u+v", {"f", "g"}, set()),
+        ("x == 1; y != 2; z <= 3", set(), set()),
+        ("E.disc = 1", set(), {"disc"}),
+        ('s = "a = 1"', {"s"}, set()),
+        ("x = 1 \\\\ y = 2\nz = 3", {"x", "z"}, set()),
+        ("x = 1 /* y = 2\n w = 3 */ z = 4", {"x", "z"}, set()),
+        ('x = "\\" y = 2"', {"x"}, set()),
+    ],
+)
+def test_definitions(code, names, members):
+    assert definitions(code) == (names, members)
+
+
+@pytest.mark.parametrize(
+    "code, expected",
+    [
+        ('install("addii", "GG")', True),
+        ('read("f.gp")', True),
+        ("\\r f.gp", True),
+        ("x = 1", False),
+        ('print("read(")', False),
+        ("\\\\ read(\nx = 1", False),
+    ],
+)
+def test_defines_indirectly(code, expected):
+    assert defines_indirectly(code) == expected
+
+
+@pytest.mark.parametrize(
+    "code, names",
+    [
+        ("x += 1; y++; v[2] = 3", {"x", "y", "v"}),
+        ("f(&a); listput(L, 1); mapput(M, 1, 2)", {"a", "L", "M"}),
+        ("\\\\ nothing\nw = 1", {"w"}),
+        ("x == y", set()),
+    ],
+)
+def test_changed_names(code, names):
+    assert changed_names(code) == names
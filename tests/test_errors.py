@@ -0,0 +1,114 @@
+import pytest
+
+from gp_kernel.errors import ErrorWatch, GPError, error_names, find_error
+
+# the messages of gp (2.17) for each error class, those that are hard to
+# raise as gp formats them
+messages = [
+    ("  ***   syntax error, unexpected ++, expecting end of file: x^2++", "e_SYNTAX"),
+    ("  ***   user error: boom", "e_USER"),
+    ("  *** bug in gerepile, please report.", "e_BUG"),
+    ("  ***   alarm interrupt after 991 ms.", "e_ALARM"),
+    ("  *** the thread stack overflows !", "e_STACKTHREAD"),
+    ("  *** the PARI stack overflows !", "e_STACK"),
+    ("  *** vecsort: not enough memory", "e_MEM"),
+    ("  *** not enough precomputed primes, need primelimit ~ 1000", "e_MAXPRIME"),
+    ("  *** read: error opening input file: `/nonexistent/file'.", "e_FILE"),
+    ("  *** write: error while writing to file x.", "e_FILE"),
+    ("  *** _^_: overflow in expo().", "e_OVERFLOW"),
+    ("  *** _^_: not a prime number in gpow: 4.", "e_PRIME"),
+    ("  *** polroots: zero polynomial in roots.", "e_ROOTS0"),
+    ("  *** polroots: constant polynomial in roots.", "e_CONSTPOL"),
+    ("  *** nfinit: not an irreducible polynomial in nfinit: x^2 - 1.", "e_IRREDPOL"),
+    ("  *** chinese: elements not coprime in chinese:", "e_COPRIME"),
+    ("  *** _/_: impossible inverse in gdiv: 0.", "e_INV"),
+    ("  *** log: domain error in log: argument = 0", "e_DOMAIN"),
+    ("  *** sqrtn: not an n-th power residue in gsqrtn: Mod(2, 7).", "e_SQRTN"),
+    ("  *** matsolve: inconsistent dimensions in gauss.", "e_DIM"),
+    ("  *** _+_: inconsistent moduli in Fp_add: 3 != 5", "e_MODULUS"),
+    ("  *** _+_: inconsistent variables in RgX_add, x != y.", "e_VAR"),
+    ("  *** _+_: incorrect priority in gadd: variable x < y", "e_PRIORITY"),
+    ("  *** ellinit: incorrect type in ellinit (t_VEC).", "e_TYPE"),
+    ("  *** _+_: forbidden addition t_INT + t_STR.", "e_TYPE2"),
+    ("  *** _+_: inconsistent addition t_VEC (2 elts) + t_VEC (3 elts).", "e_OP"),
+    ("  ***   nonexistent component: index > 1", "e_COMPONENT"),
+    ("  ***   not a function in function call", "e_NOTFUNC"),
+    ("  *** sorry, ellinit for this curve is not yet implemented.", "e_IMPL"),
+    ("  *** sorry, 'alarm' not available on this system.", "e_ARCH"),
+    ("  *** package elldata is required, please install it.", "e_PACKAGE"),
+    ("  *** factor: some other failure.", "e_MISC"),
+]
+
+
+@pytest.mark.parametrize("message, ename", messages)
+def test_ename(message, ename):
+    error = GPError(["  ***   at top-level: x", "  ***                 ^-", message])
+    assert error.ename == ename
+    assert error.evalue == message.lstrip(" *")
+
+
+def test_every_ename():
+    assert {name for _, name in error_names} <= {name for _, name in messages}
+
+
+def test_context_lines_are_not_the_message():
+    output = (
+        "  ***   at top-level: g(0)\r\n"
+        "  ***                 ^----\r\n"
+        "  ***   in function g: 1/x\r\n"
+        "  ***                   ^--\r\n"
+        "  *** _/_: impossible inverse in gdiv: 0.\r\n"
+        "5\r\n"
+    )
+    error = find_error(output)
+    assert error.ename == "e_INV"
+    assert error.evalue == "_/_: impossible inverse in gdiv: 0."
+    assert len(error.traceback) == 5
+
+
+def test_message_on_several_lines():
+    error = find_error(
+        "  ***   at top-level: chinese(Mod(1,2),Mod(1,4))\n"
+        "  ***                 ^-------------------------\n"
+        "  *** chinese: elements not coprime in chinese:\n"
+        "    Mod(1, 2)\n"
+        "    Mod(1, 4)\n"
+    )
+    assert error.ename == "e_COPRIME"
+    assert error.evalue.splitlines() == [
+        "chinese: elements not coprime in chinese:",
+        "Mod(1, 2)",
+        "Mod(1, 4)",
+    ]
+
+
+@pytest.mark.parametrize(
+    "output",
+    [
+        "1\n2\n",
+        "  ***   user warning: w\n2\n",
+        "  ***   Warning: increasing stack size to 16000000.\n",
+    ],
+)
+def test_no_error(output):
+    assert find_error(output) is None
+
+
+@pytest.mark.parametrize("size", [1, 2, 5, 40])
+def test_fed_in_chunks(size):
+    output = (
+        "1\r\n"
+        "  ***   at top-level: 1/0\r\n"
+        "  ***                  ^--\r\n"
+        "  *** _/_: impossible inverse in gdiv: 0.\r\n"
+        "  ***   at top-level: error(\"boom\")\r\n"
+        "  ***                 ^-------------\r\n"
+        "  ***   user error: boom"
+    )
+    watch = ErrorWatch()
+    for start in range(0, len(output), size):
+        watch.feed(output[start : start + size])
+    error = watch.close()
+    # the first error only
+    assert error.ename == "e_INV"
+    assert len(error.traceback) == 3
@@ -0,0 +1,121 @@
+import re
+
+import pytest
+
+from gp_kernel.output import OutputBudget, missing_bytes
+
+
+def budget(tmp_path, limit, **options):
+    sent = []
+    return OutputBudget(sent.append, limit, str(tmp_path / "out.txt"), **options), sent
+
+
+def lines(start, stop):
+    return "".join(f"line {i}\n" for i in range(start, stop))
+
+
+@pytest.mark.parametrize(
+    "data, missing",
+    [
+        (b"", 0),
+        (b"abc", 0),
+        ("é".encode(), 0),
+        ("é".encode()[:1], 1),
+        ("a€".encode()[:2], 2),
+        ("a€".encode()[:3], 1),
+        ("😀".encode()[:1], 3),
+        ("😀".encode()[:3], 1),
+        ("😀".encode(), 0),
+    ],
+)
+def test_missing_bytes(data, missing):
+    assert missing_bytes(data) == missing
+
+
+def test_within_limit(tmp_path):
+    out, sent = budget(tmp_path, 100)
+    out.write("abc\n")
+    out.write("")
+    out.write("def\n")
+    out.close()
+    assert sent == ["abc\n", "def\n"]
+    assert not out.truncated
+    assert not (tmp_path / "out.txt").exists()
+
+
+def test_no_limit(tmp_path):
+    out, sent = budget(tmp_path, 0)
+    out.write(lines(0, 1000))
+    out.close()
+    assert "".join(sent) == lines(0, 1000)
+    assert not out.truncated
+    assert out.head == []
+
+
+def test_head_and_tail(tmp_path):
+    output = lines(0, 1000)
+    out, sent = budget(tmp_path, 100, tail_size=64)
+    for start in range(0, len(output), 37):
+        out.write(output[start : start + 37])
+    out.close()
+    assert out.truncated
+    head, notice, tail = "".join(sent[:-2]), sent[-2], sent[-1]
+    # the first `limit` characters, then a notice and the tail
+    assert head == output[:100]
+    assert output.endswith(tail)
+    assert tail.startswith("line ") and len(tail) <= 64
+    omitted = int(re.search(r"(\d+) bytes of output omitted", notice)[1])
+    assert omitted == len(output) - 100 - len(tail)
+    assert "up to its first" not in notice
+    # the whole output is in the file, head included
+    assert (tmp_path / "out.txt").read_text() == output
+
+
+def test_short_rest(tmp_path):
+    out, sent = budget(tmp_path, 10, tail_size=64)
+    out.write("0123456789abcdef")
+    out.close()
+    # the rest fits in the tail: no notice
+    assert sent == ["0123456789", "abcdef"]
+    assert out.shown == out.spilled
+
+
+def test_spill_limit(tmp_path):
+    output = lines(0, 1000)
+    out, sent = budget(tmp_path, 100, tail_size=64, spill_limit=500)
+    out.write(output)
+    out.close()
+    assert out.spilled == 500
+    assert out.dropped == len(output) - 500
+    assert (tmp_path / "out.txt").read_bytes() == output[:500].encode()
+    assert "up to its first 500 bytes" in sent[-2]
+    # the tail is the end of the output, past the cap
+    assert output.endswith(sent[-1])
+
+
+def test_more(tmp_path):
+    output = lines(0, 1000)
+    out, _ = budget(tmp_path, 100, tail_size=64)
+    out.write(output)
+    out.close()
+    pages = []
+    while out.shown < out.spilled:
+        pages.append(out.more(300))
+    assert "".join(pages) == output[100:]
+    # the pages end at a line end, but the last
+    assert all(page.endswith("\n") for page in pages)
+    assert all(len(page) <= 300 for page in pages)
+    assert out.more(300) == ""
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 64])
+def test_more_multibyte(tmp_path, size):
+    # no line end to cut the pages at
+    output = "x" * 10 + "é€😀" * 50
+    out, _ = budget(tmp_path, 10, tail_size=8)
+    out.write(output)
+    out.close()
+    pages = []
+    while out.shown < out.spilled:
+        pages.append(out.more(size))
+    assert "".join(pages) == output[10:]
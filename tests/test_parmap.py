@@ -0,0 +1,80 @@
+import asyncio
+import shutil
+import time
+
+import pytest
+
+from gp_kernel.parmap import progress_text, split_arguments
+from gp_kernel.runner import RunnerKernel
+
+needs_gp = pytest.mark.skipif(shutil.which("gp") is None, reason="needs gp")
+
+
+@pytest.mark.parametrize(
+    "text, parts",
+    [
+        ("f, V", ["f", "V"]),
+        ("x -> x^2, [1..5]", ["x -> x^2", "[1..5]"]),
+        ("(x,y) -> x+y, V", ["(x,y) -> x+y", "V"]),
+        ("x -> [x, 1], vector(3, i, i)", ["x -> [x, 1]", "vector(3, i, i)"]),
+        ('x -> Str(x, ","), V', ['x -> Str(x, ",")', "V"]),
+        ('x -> "a\\",b", V', ['x -> "a\\",b"', "V"]),
+        ("x -> {x, 1}, V", ["x -> {x, 1}", "V"]),
+        ("f", ["f"]),
+        ("", [""]),
+        ("f,", ["f", ""]),
+    ],
+)
+def test_split_arguments(text, parts):
+    assert split_arguments(text) == parts
+
+
+def test_progress_text():
+    text = progress_text(3, 10, 2, time.monotonic() - 1.5)
+    assert text.startswith("%parmap: 3/10 done with 2 workers in 1.")
+    assert text.endswith("s")
+
+
+@pytest.fixture
+def kernel(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    kernel = RunnerKernel(parmap_workers=2, parmap_retries=1)
+    kernel.loop = asyncio.new_event_loop()
+    yield kernel
+    kernel.do_shutdown(False)
+    kernel.loop.close()
+
+
+@needs_gp
+def test_map(kernel):
+    reply, _ = kernel.run_cell("%parmap R = x -> x^2, [1..20]")
+    assert reply["status"] == "ok"
+    reply, output = kernel.run_cell("R == vector(20, i, i^2)")
+    assert output.split()[-1] == "1"
+
+
+@needs_gp
+def test_usage(kernel):
+    reply, output = kernel.run_cell("%parmap R = [1..3]")
+    assert output.startswith("%parmap: usage:")
+
+
+@needs_gp
+@pytest.mark.parametrize(
+    "cell, ename",
+    [
+        # gp's error in the function
+        ("%parmap R = x -> 1/(x-3), [1..5]", "e_INV"),
+        # in the vector
+        ("%parmap R = x -> x, 1/0", "e_INV"),
+        # the workers killed
+        ('%parmap R = x -> if(x == 2, system("kill -9 $PPID"), x), [1..3]', "e_MISC"),
+    ],
+)
+def test_error_reply(kernel, cell, ename):
+    reply, output = kernel.run_cell(cell + "\n7")
+    assert reply["status"] == "error"
+    assert reply["ename"] == ename
+    assert reply["evalue"]
+    # as gp does, the rest of the cell runs
+    assert output.rstrip().endswith("7")
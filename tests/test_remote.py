@@ -0,0 +1,109 @@
+"""The kernel driving gp through an agent on localhost (needs gp)."""
+import asyncio
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+
+import pytest
+
+from gp_kernel.remote import AgentClient
+from gp_kernel.runner import RunnerKernel
+
+pytestmark = pytest.mark.skipif(shutil.which("gp") is None, reason="needs gp")
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+token = "secret-token"
+
+
+@pytest.fixture(scope="module")
+def agent(tmp_path_factory):
+    env = dict(
+        os.environ,
+        GP_KERNEL_REMOTE_TOKEN=token,
+        PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get("PYTHONPATH")])),
+    )
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gp_kernel.remote", "--listen", "127.0.0.1:0"],
+        stdout=subprocess.PIPE,
+        text=True,
+        env=env,
+    )
+    try:
+        line = process.stdout.readline()
+        port = re.search(r"(\d+)\)$", line.strip()).group(1)
+        yield f"127.0.0.1:{port}"
+    finally:
+        process.terminate()
+        process.wait()
+
+
+@pytest.fixture
+def kernel(agent, tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    kernel = RunnerKernel(remote=agent, remote_token=token, interrupt_timeout=2)
+    kernel.loop = asyncio.new_event_loop()
+    yield kernel
+    kernel.do_shutdown(False)
+    kernel.loop.close()
+
+
+def test_streaming(kernel):
+    times = []
+    kernel.send_response = lambda stream, kind, content=None, *args, **kwargs: (
+        times.append(time.monotonic()) if kind == "stream" else None
+    )
+    start = time.monotonic()
+    reply, _ = kernel.run_cell(
+        "print(1); t = getwalltime(); while(getwalltime() - t < 1000,); print(2)"
+    )
+    end = time.monotonic()
+    assert reply["status"] == "ok"
+    # the first line arrives before the cell ends
+    assert times and times[0] - start < 0.5 < end - start
+
+
+def test_output_and_error(kernel):
+    reply, output = kernel.run_cell("x = 6; x * 7")
+    assert reply["status"] == "ok"
+    assert "42" in output
+    reply, output = kernel.run_cell("1/0")
+    assert reply["status"] == "error"
+    assert reply["ename"] == "e_INV"
+    assert "impossible inverse" in output
+
+
+def test_interrupt(kernel):
+    kernel.loop.call_later(0.5, kernel._interrupt, None, None)
+    start = time.monotonic()
+    reply, output = kernel.run_cell("while(1,)")
+    assert reply["status"] == "abort"
+    assert "Interrupted" in output
+    assert time.monotonic() - start < 2
+    reply, output = kernel.run_cell("1+1")
+    assert "2" in output
+
+
+def test_restart_after_gp_dies(kernel):
+    reply, output = kernel.run_cell("quit()")
+    assert "Restarting GP" in output
+    reply, output = kernel.run_cell("2+2")
+    assert reply["status"] == "ok"
+    assert "4" in output
+
+
+def test_wrong_token(agent):
+    client = AgentClient(agent, "not-the-token")
+    with pytest.raises(ConnectionError, match="wrong token"):
+        client.request(op="write", codes=["1"])
+    client.close()
+
+
+def test_parmap(kernel):
+    kernel.parmap_workers = 2
+    reply, output = kernel.run_cell("%parmap R = x -> x^2, [1..5]")
+    assert reply["status"] == "ok"
+    reply, output = kernel.run_cell("R")
+    assert "[1, 4, 9, 16, 25]" in output
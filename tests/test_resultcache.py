@@ -0,0 +1,118 @@
+import asyncio
+import fcntl
+import os
+import shutil
+import time
+
+import pytest
+
+from gp_kernel.resultcache import ResultCache, cache_key
+from gp_kernel.runner import RunnerKernel
+
+
+def store(cache, key, variables, output="", age=0):
+    """Commit an entry of fake .bin files, `variables` (name -> bytes),
+    last used `age` seconds ago."""
+    directory = cache.new_entry()
+    assert os.path.basename(directory).startswith(".new-")
+    for name, data in variables.items():
+        with open(os.path.join(directory, f"{name}.bin"), "wb") as f:
+            f.write(data)
+    cache.commit(key, directory, output)
+    if age:
+        manifest = os.path.join(cache.directory, key, "manifest.json")
+        then = time.time() - age
+        os.utime(manifest, (then, then))
+
+
+def test_cache_key():
+    key = cache_key("x = 1", "2.17.4", {"realprecision": 38, "seriesprecision": 16})
+    assert key == cache_key(
+        "x = 1", "2.17.4", {"seriesprecision": 16, "realprecision": 38}
+    )
+    assert key != cache_key("x = 2", "2.17.4", {"realprecision": 38})
+    assert key != cache_key("x = 1", "2.15.5", {"realprecision": 38})
+    assert key != cache_key("x = 1", "2.17.4", {"realprecision": 57})
+
+
+def test_commit_and_lookup(tmp_path):
+    cache = ResultCache(str(tmp_path / "results"), 10**6)
+    assert cache.lookup("k") is None
+    store(cache, "k", {"x": b"1234", "M": b"56"}, "%1 = 3\n")
+    entry = cache.lookup("k")
+    assert entry["output"] == "%1 = 3\n"
+    assert entry["size"] == 6 + len("%1 = 3\n")
+    assert entry["files"] == {
+        name: str(tmp_path / "results" / "k" / f"{name}.bin") for name in ("x", "M")
+    }
+    # no .new- directory is left behind
+    assert sorted(os.listdir(cache.directory)) == [".lock", "k"]
+
+
+def test_commit_stored_first(tmp_path):
+    cache = ResultCache(str(tmp_path), 10**6)
+    store(cache, "k", {"x": b"first"}, "first\n")
+    store(cache, "k", {"x": b"second"}, "second\n")
+    assert cache.lookup("k")["output"] == "first\n"
+    assert not any(name.startswith(".new-") for name in os.listdir(tmp_path))
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache = ResultCache(str(tmp_path), 250)
+    store(cache, "a", {"x": b"a" * 100}, age=30)
+    store(cache, "b", {"x": b"b" * 100}, age=20)
+    # a lookup makes "a" the most recently used
+    assert cache.lookup("a") is not None
+    store(cache, "c", {"x": b"c" * 100})
+    assert cache.lookup("b") is None
+    assert cache.lookup("a") is not None
+    assert cache.lookup("c") is not None
+    # the dropped entry is renamed away, then removed
+    assert not any(name.startswith(".old-") for name in os.listdir(tmp_path))
+
+
+def test_evict_stale_new_entries(tmp_path):
+    cache = ResultCache(str(tmp_path), 10**6)
+    stale = cache.new_entry()
+    then = time.time() - 2 * 86400
+    os.utime(stale, (then, then))
+    fresh = cache.new_entry()
+    cache.evict()
+    assert not os.path.exists(stale)
+    # maybe being written by another kernel
+    assert os.path.exists(fresh)
+
+
+def test_evict_locked(tmp_path):
+    cache = ResultCache(str(tmp_path), 150)
+    store(cache, "a", {"x": b"a" * 100}, age=10)
+    with open(tmp_path / ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        # another kernel evicts
+        store(cache, "b", {"x": b"b" * 100})
+        assert cache.lookup("a") is not None
+    cache.evict()
+    assert cache.lookup("a") is None
+    assert cache.lookup("b") is not None
+
+
+@pytest.mark.skipif(shutil.which("gp") is None, reason="needs gp")
+@pytest.mark.parametrize("silent", [False, True])
+def test_spilled_output_not_cached(tmp_path, monkeypatch, silent):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    kernel = RunnerKernel(output_limit=100)
+    kernel.loop = asyncio.new_event_loop()
+
+    def run(code):
+        kernel.execution_count += 1
+        kernel.loop.run_until_complete(kernel.do_execute(code, silent))
+        return kernel._reply_metadata["gp_kernel"].get("cache")
+
+    try:
+        assert run("%cache\nfor(i = 1, 100, print(i))") == "miss"
+        assert run("%cache\nfor(i = 1, 100, print(i))") == "miss"
+        assert run("%cache\nprint(1)") == "miss"
+        assert run("%cache\nprint(1)") == "hit"
+    finally:
+        kernel.do_shutdown(False)
+        kernel.loop.close()
@@ -0,0 +1,307 @@
+import asyncio
+import json
+import shutil
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+import pytest
+from traitlets.config import Config
+
+from gp_kernel.runner import (
+    Result,
+    Runner,
+    RunnerKernel,
+    cell_outputs,
+    junit_report,
+    main,
+    read_cells,
+    summary,
+)
+
+needs_gp = pytest.mark.skipif(shutil.which("gp") is None, reason="needs gp")
+
+
+def write_notebook(filename, cells):
+    notebook = {
+        "cells": [
+            {
+                "cell_type": "code",
+                "source": code,
+                "metadata": {},
+                "outputs": [],
+                "execution_count": None,
+            }
+            for code in cells
+        ],
+        "metadata": {},
+        "nbformat": 4,
+        "nbformat_minor": 5,
+    }
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(notebook, f)
+
+
+@pytest.fixture
+def kernel(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    kernel = RunnerKernel()
+    kernel.loop = asyncio.new_event_loop()
+    yield kernel
+    kernel.do_shutdown(False)
+    kernel.loop.close()
+
+
+@needs_gp
+def test_batch(kernel):
+    ran = kernel.run_batch(["x = 3", "x^2", "1/0; 5", "x + 1"])
+    assert [reply["status"] for reply, _, _ in ran] == ["ok", "ok", "error", "ok"]
+    assert [reply["execution_count"] for reply, _, _ in ran] == [1, 2, 3, 4]
+    assert "9" in ran[1][1]
+    assert ran[2][0]["ename"] == "e_INV"
+    assert "4" in ran[3][1]
+
+
+@needs_gp
+def test_batch_interrupted(kernel):
+    kernel.loop.call_later(0.5, kernel._interrupt, None, None)
+    ran = kernel.run_batch(["z = 1", "while(1,)", "z = 2"])
+    # the cell after the interrupted one is cancelled
+    assert [reply["status"] for reply, _, _ in ran] == ["ok", "abort"]
+    _, output = kernel.run_cell("z")
+    assert output.split()[-1] == "1"
+
+
+@needs_gp
+def test_batch_after_idle_job(kernel):
+    kernel.checkpoint_idle = 0.1
+    kernel.run_cell("a = 7")
+    # the idle checkpoint, due while the batch runs, is stopped before it
+    slow = "t = getwalltime(); while(getwalltime() - t < 300,); a + 1"
+    ran = kernel.run_batch(["a^2", slow, "a + 2"])
+    assert [output.split()[-1] for _, output, _ in ran] == ["49", "8", "9"]
+
+
+@needs_gp
+def test_batch_gp_dies(kernel):
+    ran = kernel.run_batch(["c = 4", "quit()", "c"])
+    assert [reply["status"] for reply, _, _ in ran] == ["ok", "abort"]
+    assert "Restarting GP" in ran[1][1]
+    assert kernel.run_cell("1+1")[0]["status"] == "ok"
+
+
+def test_can_batch():
+    kernel = RunnerKernel.__new__(RunnerKernel)
+    kernel.cell_timeout = 0
+    kernel.memory_soft_limit = kernel.memory_hard_limit = 0
+    assert kernel.can_batch(["x = 1", "x \\\\ %timeout 1"])
+    assert not kernel.can_batch(["x = 1", "%timeout 1\nx"])
+    assert not kernel.can_batch(["\\\\%cache\nx = 1"])
+    kernel.cell_timeout = 10
+    assert not kernel.can_batch(["x = 1"])
+
+
+@needs_gp
+def test_runner_batch_stop(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    notebook = tmp_path / "loop.ipynb"
+    write_notebook(notebook, ["z = 1", "while(1,)", "z = 2"])
+    runner = Runner(Config(), 1, batch=True)
+
+    def stop():
+        while not runner.kernels:
+            time.sleep(0.01)
+        time.sleep(0.5)
+        runner.stop()
+
+    threading.Thread(target=stop).start()
+    [result] = runner.run([str(notebook)], lambda result: None)
+    assert [reply["status"] for reply, _, _ in result.cells] == ["ok", "abort"]
+    assert result.skipped == 1
+
+
+def ok(count):
+    return {"status": "ok", "execution_count": count}
+
+
+def failed(count, ename="e_INV"):
+    return {
+        "status": "error",
+        "execution_count": count,
+        "ename": ename,
+        "evalue": "impossible inverse",
+        "traceback": ["  ***   at top-level: 1/0", "  *** impossible inverse"],
+    }
+
+
+def test_read_cells(tmp_path):
+    script = tmp_path / "a.gp"
+    script.write_text("x = 1\ny = 2\n")
+    assert read_cells(str(script)) == (None, ["x = 1\ny = 2\n"])
+    notebook = tmp_path / "a.ipynb"
+    write_notebook(notebook, ["x = 1", ["y = 2\n", "z = 3"]])
+    data = json.loads(notebook.read_text())
+    data["cells"].insert(1, {"cell_type": "markdown", "source": "# x", "metadata": {}})
+    notebook.write_text(json.dumps(data))
+    notebook_data, cells = read_cells(str(notebook))
+    assert cells == ["x = 1", "y = 2\nz = 3"]
+    assert notebook_data == data
+
+
+@pytest.mark.parametrize(
+    "reply, output, types",
+    [
+        (ok(1), "%1 = 1\n", ["stream"]),
+        (ok(1), "", []),
+        (failed(1), "  *** impossible inverse\n", ["stream", "error"]),
+        (failed(1), "", ["error"]),
+        ({"status": "abort", "execution_count": 1}, "Interrupted\n", ["stream"]),
+    ],
+)
+def test_cell_outputs(reply, output, types):
+    outputs = cell_outputs(reply, output)
+    assert [out["output_type"] for out in outputs] == types
+    if output:
+        assert outputs[0] == {"output_type": "stream", "name": "stdout", "text": output}
+    if "error" in types:
+        assert outputs[-1]["ename"] == "e_INV"
+        assert outputs[-1]["traceback"] == reply["traceback"]
+
+
+def make_result(cells, skipped=0, error=None):
+    result = Result("a.ipynb")
+    result.cells = [(reply, output, 0.25) for reply, output in cells]
+    result.skipped = skipped
+    result.error = error
+    result.time = 1.5
+    return result
+
+
+@pytest.mark.parametrize(
+    "result, line",
+    [
+        (make_result([(ok(1), "")]), "ok       1.50s  a.ipynb  (1 cell)"),
+        (
+            make_result([(ok(1), ""), (failed(2), "")], skipped=3),
+            "FAIL     1.50s  a.ipynb  (2 cells, cell 2: e_INV, 3 skipped)",
+        ),
+        (
+            make_result([({"status": "abort", "execution_count": 1}, "")]),
+            "FAIL     1.50s  a.ipynb  (1 cell, cell 1: interrupted)",
+        ),
+        (
+            make_result([], error="OSError: no such file"),
+            "FAIL     1.50s  a.ipynb  (OSError: no such file)",
+        ),
+    ],
+)
+def test_summary(result, line):
+    assert summary(result) == line
+
+
+def test_junit_report():
+    results = [
+        make_result([(ok(1), "%1 = 1\n"), (failed(2), "")], skipped=1),
+        make_result([({"status": "abort", "execution_count": 1}, "")]),
+        make_result([], error="OSError: no such file"),
+    ]
+    suites = junit_report(results, 4.5).getroot()
+    assert {key: suites.get(key) for key in ("tests", "failures", "errors")} == {
+        "tests": "5",
+        "failures": "2",
+        "errors": "1",
+    }
+    assert suites.get("time") == "4.500"
+    first, second, third = suites.findall("testsuite")
+    assert [case.get("name") for case in first] == ["cell 1", "cell 2", "cell 3"]
+    passed, failure, skipped = first
+    assert passed.find("system-out").text == "%1 = 1\n"
+    assert passed.find("failure") is None
+    assert failure.find("failure").get("type") == "e_INV"
+    assert failure.find("failure").text == "\n".join(failed(2)["traceback"])
+    assert skipped.find("skipped") is not None
+    assert second.find("testcase/failure").get("type") == "abort"
+    assert third.get("errors") == "1"
+    assert third.find("testcase/error").get("message") == "OSError: no such file"
+
+
+class FakeKernel:
+    """Replies to the cells from a table of (status, output)."""
+
+    def __init__(self, replies):
+        self.replies = replies
+        self.count = 0
+
+    def run_cell(self, code):
+        self.count += 1
+        status, output = self.replies[code]
+        if status == "error":
+            return failed(self.count), output
+        return {"status": status, "execution_count": self.count}, output
+
+
+class FakeRunner(Runner):
+    replies = {"a": ("ok", "1\n"), "b": ("error", "oops\n"), "c": ("ok", "3\n")}
+
+    def _kernel(self, filename):
+        return FakeKernel(self.replies)
+
+    def _shutdown(self, kernel):
+        pass
+
+
+@pytest.mark.parametrize(
+    "allow_errors, stopped, statuses, skipped",
+    [
+        (False, False, ["ok", "error"], 2),
+        (True, False, ["ok", "error", "ok", "ok"], 0),
+        (False, True, [], 4),
+    ],
+)
+def test_run_file(tmp_path, allow_errors, stopped, statuses, skipped):
+    notebook = tmp_path / "n.ipynb"
+    write_notebook(notebook, ["a", "b", "c", "a"])
+    runner = FakeRunner(Config(), 1, allow_errors, output_dir=str(tmp_path / "out"))
+    runner.stopped = stopped
+    result = runner.run_file(str(notebook))
+    assert [reply["status"] for reply, _, _ in result.cells] == statuses
+    assert result.skipped == skipped
+    assert result.error is None
+    executed = json.loads((tmp_path / "out" / "n.ipynb").read_text())
+    # the cells not run have no outputs
+    counts = [cell["execution_count"] for cell in executed["cells"]]
+    assert counts == list(range(1, len(statuses) + 1)) + [None] * skipped
+
+
+def test_run_file_error(tmp_path):
+    result = FakeRunner(Config(), 1).run_file(str(tmp_path / "missing.gp"))
+    assert result.error.startswith("FileNotFoundError")
+    assert not result.ok
+
+
+@needs_gp
+def test_main(tmp_path, monkeypatch, capsys):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    script = tmp_path / "s.gp"
+    script.write_text("x = 6;\nprint(x * 7)\n")
+    notebook = tmp_path / "n.ipynb"
+    write_notebook(notebook, ["y = 2", "%timeout 10\ny^5", "1/0", "y"])
+    out = tmp_path / "out"
+    report = tmp_path / "report.xml"
+    status = main(
+        [str(script), str(notebook), "-j", "2", "--output-dir", str(out)]
+        + ["--junit", str(report)]
+    )
+    assert status == 1
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[-1].startswith("2 files, 1 failed")
+    assert (out / "s.gp.out").read_text().split() == ["42"]
+    executed = json.loads((out / "n.ipynb").read_text())
+    outputs = [cell["outputs"] for cell in executed["cells"]]
+    assert "32" in outputs[1][0]["text"]
+    assert outputs[2][-1]["ename"] == "e_INV"
+    assert outputs[3] == []
+    suites = ET.parse(report).getroot()
+    assert (suites.get("tests"), suites.get("failures")) == ("5", "1")
+    # the script alone passes
+    assert main([str(script)]) == 0
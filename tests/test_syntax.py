@@ -0,0 +1,92 @@
+import pytest
+
+from gp_kernel.syntax import Scanner, one_line, statement_starts
+
+
+@pytest.mark.parametrize(
+    "code, status, indent",
+    [
+        ("x+1", "complete", ""),
+        ("f(x", "invalid", ""),
+        ("[1,\n{2", "incomplete", "  "),
+        ("w=(\n{1", "incomplete", "  "),
+        ("b=(1\n+5)", "invalid", ""),
+        ("{\n  x\n}", "complete", ""),
+        ('print("a)")', "complete", ""),
+        ('"ab', "invalid", ""),
+        ('"a\\"b', "invalid", ""),
+        ('{s = "a\nb', "incomplete", "  "),
+        ('{s = "a\nb"}', "complete", ""),
+        ('"a\\\\"', "complete", ""),
+        ('"a\\"b" + 1', "complete", ""),
+        ("/* x", "incomplete", ""),
+        ("/* ( */ x", "complete", ""),
+        ("/* a\n*/ )", "invalid", ""),
+        ("x \\\\ (", "complete", ""),
+        ("x \\\\ (\n(", "invalid", ""),
+        ('x \\\\ "\ny', "complete", ""),
+        ("a \\ b", "complete", ""),
+        ("x+\\", "incomplete", ""),
+        ("x+\\\n", "incomplete", ""),
+        ("x+\\\n1", "complete", ""),
+        ("f(x) =", "incomplete", ""),
+        ("f(x) =  ", "incomplete", ""),
+        ("f(x) =\n{\n  x", "incomplete", "  "),
+        ("f(x) =\n{\n  x\n}", "complete", ""),
+        ("K =\n\n  5", "complete", ""),
+        ("d = 1 ==", "incomplete", ""),
+        ("h = /* c */", "incomplete", ""),
+        ("x = \\\\ c", "incomplete", ""),
+        ("x = 2 \\\\ c =", "complete", ""),
+        ('w = "="', "complete", ""),
+        ("e = 3 +", "complete", ""),
+        ("x)", "invalid", ""),
+        ("(]", "invalid", ""),
+        ("[1)", "invalid", ""),
+    ],
+)
+def test_scanner(code, status, indent):
+    scanner = Scanner()
+    scanner.feed(code)
+    assert scanner.status() == (status, indent)
+
+
+@pytest.mark.parametrize("split", [1, 3, 8])
+def test_scanner_resume(split):
+    code = 'f(x) = {\n  my(s = "}");\n  /* ) */ x\n}'
+    scanner = Scanner().resume(code[:split])
+    assert scanner.resume(code).status() == ("complete", "")
+    # what does not extend the text scanned is scanned anew
+    assert scanner.resume("x)").status() == ("invalid", "")
+
+
+def test_statement_starts():
+    assert statement_starts("a\n{b\nc}\nd") == [0, 2, 8]
+    # gp joins a line ending with = to the next one
+    assert statement_starts("f(x) =\n{\n  x\n}\ny") == [0, 15]
+    assert statement_starts("a =\n 5\nb") == [0, 7]
+    # and reads a line leaving a bracket or a string open as it is
+    assert statement_starts("b=(1\n+5)\nc") == [0, 5, 9]
+    assert statement_starts('s = "a\nb"\nt') == [0, 7, 10]
+
+
+@pytest.mark.parametrize(
+    "code, expected",
+    [
+        ("x+1", "x+1"),
+        ("x+\n2", "x+ 2"),
+        ("x+\r\n2", "x+ 2"),
+        ("x+\\\n1", "x+1"),
+        ("x \\\\ note\n+1", "x   +1"),
+        ("/* a\nb */ x*3", "  x*3"),
+        ('"s\nt"', '"s\\nt"'),
+        ('"a \\\\ b" + 1', '"a \\\\ b" + 1'),
+        ("{x", None),
+        ("/* x", None),
+        ('"ab', None),
+        ("x)", None),
+        ("x\\", None),
+    ],
+)
+def test_one_line(code, expected):
+    assert one_line(code) == expected